@@ -1,108 +1,40 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-import os, re, json
-import numpy as np
-
-# Embeddings (always via fastembed ONNX)
-try:
-    from fastembed import TextEmbedding
-except Exception:
-    TextEmbedding = None
-
-# Qdrant (optional)
-try:
-    from qdrant_client import QdrantClient
-    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-except Exception:
-    QdrantClient = None
-    Filter = FieldCondition = MatchValue = None  # type: ignore
+from typing import Optional, List
+import re
+from .logic.index import INDEX
+from .logic.embedder import EMBEDDER
+from .logic.qdrant import QDRANT, match_filter
 
 router = APIRouter(tags=["explain"])
 
-# --- Config shared with rag_router ---
-QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
-QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
-QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "rag_chunks")
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-JSONL_PATH = os.path.join(DATA_DIR, "rag_store.jsonl")
-
-# Embedding model
-_embedder = TextEmbedding() if TextEmbedding else None  # bge-small/onnx (~384d)
-
-def _client():
-    if QdrantClient is None:
-        return None
-    try:
-        return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=5.0)
-    except Exception:
-        return None
-
 def _clean(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "")).strip()
 
 def _embed_one(q: str):
-    if not _embedder:
-        return None
-    return list(_embedder.embed([q]))[0]
+    vecs = EMBEDDER.embed_queries([q])
+    return vecs[0] if vecs else None
 
-def _local_vector_search(q: str, limit: int = 5, industry: Optional[str] = None, stage: Optional[str] = None):
-    if not _embedder:
+def _local_vector_search(q: str, limit: int = 5, industry: Optional[str] = None, stage: Optional[str] = None,
+                         tags: Optional[List[str]] = None):
+    INDEX.refresh()
+    if not EMBEDDER.available or not len(INDEX):
         return []
-    corpus: List[Dict[str, Any]] = []
-    try:
-        with open(JSONL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    j = json.loads(line)
-                except Exception:
-                    continue
-                if industry and j.get("industry") != industry: continue
-                if stage and j.get("stage") != stage: continue
-                if isinstance(j.get("vector"), list):
-                    corpus.append(j)
-    except FileNotFoundError:
-        pass
-    if not corpus:
+    qv = _embed_one(q)
+    if qv is None:
         return []
+    return [{"text": r.get("text",""), "score": s} for s, r in INDEX.search(qv, limit, industry=industry, stage=stage, tags=tags)]
 
-    M = np.array([r["vector"] for r in corpus], dtype="float32")
-    M /= (np.linalg.norm(M, axis=1, keepdims=True) + 1e-8)
-    qv = np.array(_embed_one(q), dtype="float32")
-    qv /= (np.linalg.norm(qv) + 1e-8)
-
-    scores = M @ qv
-    idx = np.argsort(-scores)[:limit]
-    out = []
-    for i in idx:
-        r = corpus[int(i)]
-        out.append({"text": r.get("text",""), "score": float(scores[int(i)])})
-    return out
-
-def _qdrant_search(q: str, limit: int = 5, industry: Optional[str] = None, stage: Optional[str] = None):
-    if not _embedder:
-        return []
-    client = _client()
-    if not client:
+def _qdrant_search(q: str, limit: int = 5, industry: Optional[str] = None, stage: Optional[str] = None,
+                   tags: Optional[List[str]] = None):
+    if not EMBEDDER.available or not QDRANT.available:
         return []
     try:
         vec = _embed_one(q)
         if vec is None:
             return []
-        flt = None
-        if Filter and FieldCondition and MatchValue:
-            must = []
-            if industry: must.append(FieldCondition(key="industry", match=MatchValue(value=industry)))
-            if stage:    must.append(FieldCondition(key="stage", match=MatchValue(value=stage)))
-            if must: flt = Filter(must=must)
-        res = client.search(
-            collection_name=QDRANT_COLLECTION,
-            query_vector=vec,
-            limit=limit,
-            with_payload=True,
-            query_filter=flt,
-        )
+        flt = match_filter({k: v for k, v in (("industry", industry), ("stage", stage), ("tags", tags)) if v})
+        res = QDRANT.search(vec, limit, flt)
         return [{"text": (r.payload or {}).get("text",""), "score": float(r.score)} for r in res]
     except Exception:
         return []
@@ -174,6 +106,7 @@ class ExplainBody(BaseModel):
     rag_provider: Optional[str] = None
     industry: Optional[str] = None
     stage: Optional[str] = None
+    tags: Optional[List[str]] = None
 
 @router.post("/explain")
 def explain(body: ExplainBody):
@@ -186,9 +119,9 @@ def explain(body: ExplainBody):
     # Optional RAG enrichment
     if body.use_rag:
         query = f"{node} {stage} improve experiment measure"
-        hits = _qdrant_search(query, limit=5, industry=body.industry, stage=stage) \
+        hits = _qdrant_search(query, limit=5, industry=body.industry, stage=stage, tags=body.tags) \
                if (body.rag_provider or "").lower() == "qdrant" else \
-               _local_vector_search(query, limit=5, industry=body.industry, stage=stage)
+               _local_vector_search(query, limit=5, industry=body.industry, stage=stage, tags=body.tags)
         for h in hits[:3]:
             text = _clean(h.get("text","") if isinstance(h, dict) else h)
             if not text: continue
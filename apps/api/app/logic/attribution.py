@@ -0,0 +1,141 @@
+from __future__ import annotations
+import heapq, json, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional
+import numpy as np
+from .propagate import CompiledTree
+
+CACHE_SIZE = 128
+MIN_CONTRIBUTION = 1e-9  # paths below this (in absolute delta) are pruned
+
+def _bounds(ct: CompiledTree, term: np.ndarray, edge: np.ndarray) -> np.ndarray:
+    """Per node, the largest ``|path product × end term|`` over paths from it down to any node.
+
+    One bottom-up pass in level order: ``best[v] = max(|term[v]|, max |edge| * best[child])``.
+    """
+    best = np.abs(term)
+    mag = np.abs(edge)
+    for lv in range(1, len(ct.levels) - 1):
+        ea, eb = int(ct.indptr[ct.levels[lv]]), int(ct.indptr[ct.levels[lv + 1]])
+        np.maximum.at(best, ct.dst[ea:eb], mag[ea:eb] * best[ct.src[ea:eb]])
+    return best
+
+def top_paths(ct: CompiledTree, term: np.ndarray, edge: np.ndarray, target: int, k: int,
+              floor: float = MIN_CONTRIBUTION) -> List[Dict[str, Any]]:
+    """The ``k`` largest individual path contributions into ``target``.
+
+    A path runs from ``target`` down the in-edges to some node ``u`` and contributes
+    ``prod(edge) * term[u]``. Best-first search ordered by ``|prefix| * best[node]``;
+    ``best`` (see ``_bounds``) is the exact best completion, so paths come off the
+    heap in order and the search stops after ``k`` of them. Subtrees that cannot
+    reach ``floor`` are never expanded, and partial paths are parent pointers rather
+    than copies.
+    """
+    best = _bounds(ct, term, edge)
+    nodes: List[int] = []    # search state -> node
+    parents: List[int] = []  # search state -> previous state (-1 at target)
+    acc: List[float] = []    # search state -> product of edge derivatives so far
+    heap: List[Any] = []
+
+    def push(node: int, parent: int, a: float):
+        if not abs(a) * best[node] >= floor: return  # also drops NaN
+        nodes.append(node); parents.append(parent); acc.append(a)
+        state = len(nodes) - 1
+        heapq.heappush(heap, (-abs(a) * best[node], state, False))
+        if abs(a * term[node]) >= floor:
+            heapq.heappush(heap, (-abs(a * term[node]), state, True))
+
+    push(target, -1, 1.0)
+    out: List[Dict[str, Any]] = []
+    while heap and len(out) < k:
+        _, state, done = heapq.heappop(heap)
+        node = nodes[state]
+        if done:
+            path, s = [], state
+            while s >= 0:
+                path.append(ct.ids[nodes[s]]); s = parents[s]
+            out.append({"path": path, "contribution": float(acc[state] * term[node])})
+            continue
+        for e in range(int(ct.indptr[node]), int(ct.indptr[node + 1])):
+            push(int(ct.src[e]), state, acc[state] * float(edge[e]))
+    return out
+
+def _linearize(ct: CompiledTree, deltas: Mapping[str, float], node: Optional[str]):
+    """Target row, own deltas, total deltas and the local derivatives at them."""
+    target = ct.root if node is None else ct.index.get(node)
+    if target is None:
+        raise ValueError(f"Unknown node '{node}'.")
+    D = ct.deltas([deltas])[:, 0]
+    x = ct.propagate(D[:, None])[:, 0]
+    if not np.isfinite(x[target]):
+        raise ValueError(f"Propagation overflows at '{ct.ids[target]}'; check the weights.")
+    own, edge = ct.gains(x)
+    return target, D, x, own, edge
+
+def attribute(ct: CompiledTree, deltas: Mapping[str, float], node: Optional[str] = None,
+              k: int = 5, limit: int = 20) -> Dict[str, Any]:
+    """Attribution of ``node``'s total delta (default: the North Star) to every own delta.
+
+    Per source: ``influence`` is d node / d own delta, summed over all paths by one
+    reverse sweep (``CompiledTree.adjoint``), and ``contribution = influence * delta``.
+    ``paths`` are the ``k`` largest single-path contributions (``top_paths``), listed
+    source first. Both are exact on linear trees; ``product``/``ratio`` edges are
+    linearized at the current deltas, and ``residual`` is what that leaves unexplained.
+    """
+    target, D, x, own, edge = _linearize(ct, deltas, node)
+    influence = ct.adjoint(edge, target) * own
+    contrib = influence * D
+    rows = np.flatnonzero(contrib)
+    rows = rows[np.argsort(-np.abs(contrib[rows]), kind="stable")]
+    paths = top_paths(ct, own * D, edge, target, k)
+    return {
+        "node": ct.ids[target],
+        "total": float(x[target]),
+        "explained": float(contrib.sum()),
+        "residual": float(x[target] - contrib.sum()),
+        "contributors": [{"id": ct.ids[r], "delta": float(D[r]), "influence": float(influence[r]),
+                          "contribution": float(contrib[r])} for r in rows[:limit].tolist()],
+        "paths": paths,
+    }
+
+def sensitivity(ct: CompiledTree, deltas: Optional[Mapping[str, float]] = None, node: Optional[str] = None,
+                limit: Optional[int] = None) -> Dict[str, Any]:
+    """d ``node`` / d own delta for every upstream node, ranked by magnitude.
+
+    One ``gains`` pass and one ``CompiledTree.adjoint`` sweep, so O(edges) however
+    many nodes are ranked. ``product``/``ratio`` edges are linearized around the
+    current ``deltas`` (none: the baseline). ``sensitivity`` is the change in
+    ``node`` per unit of a node's own delta (0.01 per point); ``through`` is per unit
+    of the node's total delta, i.e. what its parents pass on.
+    """
+    target, _, x, own, edge = _linearize(ct, deltas or {}, node)
+    adj = ct.adjoint(edge, target)
+    sens = adj * own
+    rows = np.flatnonzero(sens)
+    rows = rows[rows != target]
+    rows = rows[np.argsort(-np.abs(sens[rows]), kind="stable")][:limit]
+    return {
+        "node": ct.ids[target],
+        "total": float(x[target]),
+        "ranked": [{"id": ct.ids[r], "sensitivity": float(sens[r]), "through": float(adj[r]), "delta": float(x[r])}
+                   for r in rows.tolist()],
+    }
+
+_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+def cached_attribute(key: str, ct: CompiledTree, deltas: Mapping[str, float], node: Optional[str] = None,
+                     k: int = 5, limit: int = 20) -> Dict[str, Any]:
+    """``attribute`` memoized per tree version ``key`` (see ``tree_key``) and query."""
+    full = json.dumps([key, sorted(deltas.items()), node, k, limit])
+    with _CACHE_LOCK:
+        hit = _CACHE.get(full)
+        if hit is not None:
+            _CACHE.move_to_end(full)
+            return hit
+    out = attribute(ct, deltas, node, k, limit)
+    with _CACHE_LOCK:
+        _CACHE[full] = out
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return out
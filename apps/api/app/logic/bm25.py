@@ -0,0 +1,155 @@
+from __future__ import annotations
+import os, re, json, math, uuid, threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .ann import topk
+
+K1 = float(os.environ.get("RAG_BM25_K1", "1.2"))
+B = float(os.environ.get("RAG_BM25_B", "0.75"))
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").casefold())
+
+class BM25Index:
+    """Incremental inverted index over chunk text with Okapi BM25 scoring.
+
+    Same layout as ``PostingsIndex``: per term a sorted array of row ids with their
+    term frequencies, plus a pending tail of rows added since the term was last
+    queried. A query touches only its terms' postings, so cost follows how common
+    the query terms are, not the corpus size. ``save``/``load`` snapshot it in CSR
+    form, so a restart only tokenizes rows written after the snapshot.
+    """
+
+    def __init__(self, k1: float = K1, b: float = B):
+        self.k1, self.b = k1, b
+        self.rows = 0  # rows [0, rows) are indexed
+        self.total_len = 0
+        self._len = np.zeros(0, dtype=np.float32)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def add(self, records: List[Dict[str, Any]], start: int):
+        """Index ``records`` as rows ``start...``; rows already covered (e.g. by a snapshot) are skipped."""
+        with self._lock:
+            skip = max(0, self.rows - start)
+            if skip >= len(records):
+                return
+            records, start = records[skip:], start + skip
+            lens = np.zeros(len(records), dtype=np.float32)
+            for k, r in enumerate(records):
+                terms = tokenize(r.get("text", ""))
+                lens[k] = len(terms)
+                for t, tf in Counter(terms).items():
+                    rows, tfs = self._pending.setdefault(t, ([], []))
+                    rows.append(start + k)
+                    tfs.append(tf)
+            end = start + len(records)
+            if end > len(self._len):
+                grown = np.zeros(max(end, 2 * len(self._len), 1024), dtype=np.float32)
+                grown[:self.rows] = self._len[:self.rows]
+                self._len = grown
+            self._len[start:end] = lens
+            self.total_len += int(lens.sum())
+            self.rows = end
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            rows, tfs = self._arrays.get(term, (None, None))
+            extra = self._pending.pop(term, None)
+            if extra:
+                r, f = np.asarray(extra[0], dtype=np.int64), np.asarray(extra[1], dtype=np.float32)
+                rows, tfs = (np.concatenate([rows, r]), np.concatenate([tfs, f])) if rows is not None else (r, f)
+                self._arrays[term] = (rows, tfs)
+        if rows is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return rows, tfs
+
+    def scores(self, query: str, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows matching any query term and their BM25 scores; ``mask`` (bool per row) restricts them."""
+        n = self.rows if mask is None else min(self.rows, len(mask))
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not n or not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        avgdl = self.total_len / n or 1.0
+        dl = self._len[:n]
+        ids, contrib = [], []
+        for t in terms:
+            rows, tf = self.postings(t)
+            k = np.searchsorted(rows, n)  # rows added after ``n`` was read
+            rows, tf = rows[:k], tf[:k]
+            if not len(rows): continue
+            idf = math.log(1.0 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            if mask is not None:
+                keep = mask[rows]
+                rows, tf = rows[keep], tf[keep]
+            ids.append(rows)
+            contrib.append(idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl[rows] / avgdl)))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, contrib = np.concatenate(ids), np.concatenate(contrib)
+        if len(ids) > n // 8:  # dense: one pass over a corpus-sized accumulator
+            acc = np.bincount(ids, weights=contrib, minlength=n)
+            rows = np.flatnonzero(acc)
+            return rows, acc[rows].astype(np.float32)
+        rows, inv = np.unique(ids, return_inverse=True)
+        return rows, np.bincount(inv, weights=contrib).astype(np.float32)
+
+    def search(self, query: str, limit: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        rows, s = self.scores(query, mask)
+        top = topk(s, limit)
+        return rows[top], s[top]
+
+    def save(self, path: str, key: Any, upto: int):
+        """Snapshot rows ``[0, upto)`` as CSR arrays; ``key`` describes the store layout they refer to."""
+        with self._lock:
+            terms = sorted(set(self._arrays) | set(self._pending))
+        parts = []
+        for t in terms:
+            rows, tfs = self.postings(t)
+            k = np.searchsorted(rows, upto)
+            parts.append((rows[:k], tfs[:k]))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r, _ in parts], out=indptr[1:])
+        tmp = f"{path}.{os.getpid()}-{uuid.uuid4().hex}.tmp.npz"  # workers and threads may save at once
+        try:
+            np.savez(tmp, terms=np.array(terms, dtype=str), indptr=indptr,
+                     rows=np.concatenate([r for r, _ in parts]) if parts else np.zeros(0, dtype=np.int64),
+                     tfs=np.concatenate([f for _, f in parts]) if parts else np.zeros(0, dtype=np.float32),
+                     lens=self._len[:upto].copy(), key=np.array([json.dumps(key)]))
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def load(self, path: str, accept: Callable[[Any], bool]) -> bool:
+        """Restore a snapshot if ``accept(key)`` says its layout still matches the store.
+
+        A missing or unreadable snapshot (e.g. torn by a crash) counts as none: the
+        index is then rebuilt from the store.
+        """
+        try:
+            with np.load(path) as z:
+                if not accept(json.loads(str(z["key"][0]))):
+                    return False
+                terms, indptr, rows, tfs, lens = z["terms"].tolist(), z["indptr"], z["rows"], z["tfs"], z["lens"]
+        except Exception:
+            return False
+        arrays = {t: (rows[indptr[k]:indptr[k + 1]], tfs[indptr[k]:indptr[k + 1]]) for k, t in enumerate(terms)}
+        with self._lock:
+            self._arrays, self._pending = arrays, {}
+            self._len, self.rows, self.total_len = lens.astype(np.float32), len(lens), int(lens.sum())
+        return True
+
+def rrf(rankings: List[Sequence[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """Reciprocal rank fusion of several ranked id lists, best first."""
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+import os, re, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+import httpx
+
+INGEST_WORKERS = int(os.environ.get("RAG_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+USER_AGENT = os.environ.get("RAG_USER_AGENT", "metric-trees-rag/1.0")
+
+# Parsing/chunking/embedding of fetched pages; sized to the CPU, shared by all bulk ingests
+EXECUTOR = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+def _locs(xml: str) -> List[str]:
+    return [u.strip() for u in re.findall(r"<loc>\s*([^<]+?)\s*</loc>", xml)]
+
+async def sitemap_urls(client: httpx.AsyncClient, url: str, limit: int = 10000, depth: int = 2) -> List[str]:
+    """Page URLs listed in a sitemap, following nested sitemap indexes ``depth`` levels."""
+    r = await client.get(url)
+    r.raise_for_status()
+    out: List[str] = []
+    for loc in _locs(r.text):
+        if len(out) >= limit: break
+        if depth > 0 and re.search(r"sitemap[^/]*\.xml(\.gz)?$", loc, re.I):
+            out += await sitemap_urls(client, loc, limit - len(out), depth - 1)
+        else:
+            out.append(loc)
+    return out[:limit]
+
+async def ingest_urls(urls: List[str], process: Callable[[str, bytes, httpx.Headers], Dict[str, Any]],
+                      sitemap: Optional[str] = None, concurrency: int = 16, per_host: int = 4,
+                      timeout: float = 20.0, max_urls: int = 10000,
+                      headers: Optional[Callable[[str], Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+    """Fetch ``urls`` (plus any from ``sitemap``) concurrently and feed each body to ``process``.
+
+    One pooled ``httpx.AsyncClient`` serves every fetch; ``concurrency`` caps requests
+    in flight and ``per_host`` caps them per host. ``process(url, body, response_headers)``
+    is CPU-bound and runs on ``EXECUTOR``; fetched bodies count against ``inflight``
+    until processed, so fast fetching cannot pile pages up in memory. Its dict is
+    merged into the URL's result.
+
+    ``headers(url)`` adds per-request headers; with conditional ones
+    (``If-None-Match`` ...) a ``304`` is reported as ``changed: False`` and never processed.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True,
+                                 headers={"user-agent": USER_AGENT}) as client:
+        todo = list(dict.fromkeys(urls))
+        if sitemap:
+            todo = list(dict.fromkeys(todo + await sitemap_urls(client, sitemap, max_urls)))
+        todo = todo[:max_urls]
+        hosts: Dict[str, asyncio.Semaphore] = {}
+        fetch_slots = asyncio.Semaphore(concurrency)
+        inflight = asyncio.Semaphore(concurrency + 2 * INGEST_WORKERS)
+        loop = asyncio.get_running_loop()
+
+        async def one(url: str) -> Dict[str, Any]:
+            host = hosts.setdefault(urlsplit(url).netloc, asyncio.Semaphore(per_host))
+            try:
+                async with inflight:
+                    async with fetch_slots, host:
+                        r = await client.get(url, headers=headers(url) if headers else None)
+                        if r.status_code == 304:
+                            return {"url": url, "ok": True, "changed": False, "chunks": 0}
+                        r.raise_for_status()
+                    out = await loop.run_in_executor(EXECUTOR, process, url, r.content, r.headers)
+                return {"url": url, "ok": True, "chunks": 0, **out}
+            except Exception as e:
+                return {"url": url, "ok": False, "chunks": 0, "error": str(e) or type(e).__name__}
+
+        return await asyncio.gather(*(one(u) for u in todo))
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import os, re, time, atexit, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", "4096"))
+CACHE_TTL = float(os.environ.get("RAG_QUERY_CACHE_TTL", "86400"))
+CACHE_PATH = os.environ.get("RAG_QUERY_CACHE_PATH")  # e.g. data/query_cache.npz; unset = memory only
+
+def normalize(text: str) -> str:
+    """Collapse whitespace only: case can change a query's embedding, so it stays in the key."""
+    return re.sub(r"\s+", " ", (text or "")).strip()
+
+def _frozen(vec) -> np.ndarray:
+    v = np.array(vec, dtype="float32")
+    v.setflags(write=False)
+    return v
+
+class EmbeddingCache:
+    """Bounded, thread-safe LRU of query embeddings keyed on (model, normalized text).
+
+    Entries expire ``ttl`` seconds after insertion; the least recently used entry is
+    evicted past ``maxsize``. Cached vectors are read-only, as every hit shares them.
+    With ``path`` set the cache is loaded at start-up and written back on
+    interpreter exit, so warm queries survive restarts.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL, path: Optional[str] = CACHE_PATH):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = self.misses = self.evictions = 0
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, text: str, model: str) -> Optional[np.ndarray]:
+        key = (model, normalize(text))
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and time.time() - hit[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            if hit is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model: str, vec) -> None:
+        key = (model, normalize(text))
+        with self._lock:
+            self._data[key] = (time.time(), _frozen(vec))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_embed(self, texts: Sequence[str], model: str, embed: Callable[[List[str]], List[Any]]) -> List[np.ndarray]:
+        """Cached vectors for ``texts``; all misses go to ``embed`` in a single call.
+
+        The result lines up index-for-index with ``texts``, or is empty when ``embed``
+        returned nothing (model unavailable); a partial answer raises ``ValueError``.
+        """
+        out: List[Optional[np.ndarray]] = [self.get(t, model) for t in texts]
+        todo: Dict[str, List[int]] = {}
+        for i, v in enumerate(out):
+            if v is None:
+                todo.setdefault(normalize(texts[i]), []).append(i)
+        if todo:
+            firsts = [idx[0] for idx in todo.values()]
+            vecs = embed([texts[i] for i in firsts])
+            if not len(vecs):
+                return []
+            if len(vecs) != len(firsts):
+                raise ValueError(f"embedder returned {len(vecs)} vectors for {len(firsts)} texts")
+            for idx, v in zip(todo.values(), vecs):
+                v = _frozen(v)
+                self.put(texts[idx[0]], model, v)
+                for i in idx:
+                    out[i] = v
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            items = [(k, v) for k, v in self._data.items() if time.time() - v[0] < self.ttl]
+        if not items:
+            return
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, models=np.array([k[0] for k, _ in items]), texts=np.array([k[1] for k, _ in items]),
+                 times=np.array([v[0] for _, v in items]), vectors=np.stack([v[1] for _, v in items]))
+        os.replace(tmp, self.path)
+
+    def load(self) -> None:
+        try:
+            z = np.load(self.path)
+        except (FileNotFoundError, OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for m, t, ts, v in zip(z["models"].tolist(), z["texts"].tolist(), z["times"].tolist(), z["vectors"]):
+                if now - ts < self.ttl:
+                    self._data[(m, t)] = (ts, _frozen(v))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+QUERY_CACHE = EmbeddingCache()
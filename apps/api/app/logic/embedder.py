@@ -0,0 +1,91 @@
+from __future__ import annotations
+import os, threading
+from typing import Any, Dict, List, Optional
+from .embed_cache import QUERY_CACHE
+
+# Embeddings (always via fastembed ONNX)
+try:
+    from fastembed import TextEmbedding
+except Exception:
+    TextEmbedding = None
+
+EMBED_MODEL = os.environ.get("RAG_EMBED_MODEL")  # None = fastembed default (bge-small, 384d)
+DEFAULT_MODEL = "BAAI/bge-small-en-v1.5"  # fastembed's default
+
+class Embedder:
+    """Single, lazily loaded fastembed model shared by every router in the process.
+
+    Nothing is loaded at import: the first ``embed`` call loads the model (other
+    callers wait on the same load), or ``warmup()`` loads it on a background thread
+    right after start-up so ``/healthz`` answers immediately and ``/readyz`` flips
+    once the model is resident.
+    """
+
+    def __init__(self, model_name: Optional[str] = EMBED_MODEL):
+        self._name = model_name
+        self._model = None
+        self._error: Optional[str] = None
+        self._loading = False
+        self._dim: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return TextEmbedding is not None and self._error is None
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model_name(self) -> str:
+        return self._name or "default"
+
+    @property
+    def dim(self) -> Optional[int]:
+        """Vector size of the configured model: from fastembed's model list, else by
+        embedding a probe text (loads the model); None if there is no model."""
+        if self._dim is None and self.available:
+            name = (self._name or DEFAULT_MODEL).lower()
+            try:
+                self._dim = next((int(m["dim"]) for m in TextEmbedding.list_supported_models()
+                                  if str(m.get("model", "")).lower() == name), None)
+            except Exception:
+                pass
+            if self._dim is None:
+                vecs = self.embed(["dimension probe"])
+                self._dim = len(vecs[0]) if vecs else None
+        return self._dim
+
+    def get(self):
+        if self._model is None and self.available:
+            with self._lock:
+                if self._model is None and self._error is None:
+                    self._loading = True
+                    try:
+                        self._model = TextEmbedding(self._name) if self._name else TextEmbedding()
+                    except Exception as e:
+                        self._error = str(e)
+                    finally:
+                        self._loading = False
+        return self._model
+
+    def warmup(self) -> None:
+        if self.available and not self.ready:
+            threading.Thread(target=self.get, name="embedder-warmup", daemon=True).start()
+
+    def embed(self, texts: List[str]) -> List[Any]:
+        model = self.get()
+        if model is None: return []
+        return list(model.embed(texts))
+
+    def embed_queries(self, qs: List[str]) -> List[Any]:
+        """Query embeddings through the shared LRU cache; repeats skip the model."""
+        if not self.available: return []
+        return QUERY_CACHE.get_or_embed(qs, self.model_name, self.embed)
+
+    def status(self) -> Dict[str, Any]:
+        return {"available": self.available, "ready": self.ready, "loading": self._loading,
+                "model": self.model_name, "dim": self._dim, "error": self._error}
+
+EMBEDDER = Embedder()
@@ -0,0 +1,489 @@
+from __future__ import annotations
+import os, time, atexit, bisect, threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from .store import STORE, SegmentStore
+from .ann import IVFIndex, topk
+from .postings import PostingsIndex
+from .quant import Int8Quantizer, Int8Matrix
+from .bm25 import BM25Index
+from .tfidf import TfidfIndex
+
+# How often to stat the store for rows appended by other worker processes
+DISK_CHECK_SECS = float(os.environ.get("RAG_INDEX_DISK_CHECK_SECS", "1.0"))
+# IVF approximate search kicks in at this corpus size (0 disables it)
+ANN_MIN_ROWS = int(os.environ.get("RAG_ANN_MIN_ROWS", "50000"))
+ANN_NPROBE = int(os.environ.get("RAG_ANN_NPROBE", "8"))
+# "int8" keeps only quantized codes in memory and re-ranks from the mapped float32 segments
+QUANT = os.environ.get("RAG_QUANT", "none").lower()
+QUANT_RERANK = int(os.environ.get("RAG_QUANT_RERANK", "4"))
+# Re-snapshot the BM25 and TF-IDF indexes after this many newly indexed rows (and at exit)
+BM25_SAVE_ROWS = int(os.environ.get("RAG_BM25_SAVE_ROWS", "20000"))
+
+class CorpusIndex:
+    """Process-wide in-memory view of the local store shared by the rag and explain routers.
+
+    Holds the normalized float32 matrix and, per row, only what lookups and
+    tombstones need (id, content hash, byte offset of its metadata line); full
+    records, chunk text included, are read from the segment ``.meta.jsonl`` files
+    for the hits a query returns (``records``). ``refresh()`` only reads what was
+    appended since the last load: per segment it remembers how many rows it has
+    and the byte offset reached in the metadata file. In-process appends
+    bump ``store.generation`` and are picked up on the next query; appends from other
+    workers are noticed by a cheap size check at most every ``DISK_CHECK_SECS``.
+
+    Past ``ANN_MIN_ROWS`` rows an IVF index is trained in a background thread (exact
+    search serves until it is ready); later rows are assigned to its lists on refresh
+    and it is retrained in the background whenever the corpus doubles.
+
+    Metadata filters resolve through ``postings`` (kept in sync on refresh) to a
+    row subset; selective filters are scored exactly over just those rows.
+
+    With ``RAG_QUANT=int8`` the in-memory matrix holds int8 codes instead of floats:
+    coarse scoring runs on the codes and the top ``limit * QUANT_RERANK`` candidates
+    are re-scored exactly against the memory-mapped float32 segments.
+
+    Tombstoned rows (``store.delete``) stay in the matrix but are masked out of every
+    search through ``alive``.
+
+    Everything numbered by row lives in one ``_State`` per store epoch. Queries take
+    the current state once and read only from it, without the lock; in-epoch
+    refreshes only append to it (rows below a reader's ``n`` never change), and a
+    compaction's reload fills a fresh state that is published whole when complete.
+
+    ``bm25`` is the lexical index over the same rows; it is restored from
+    ``<store>/bm25.npz`` on first load when that snapshot matches the segment layout.
+    ``tfidf`` (cosine TF-IDF, used by ``SimpleRAG``) is kept the same way and mapped
+    from ``<store>/tfidf/``.
+    """
+
+    def __init__(self, store: SegmentStore):
+        self.store = store
+        self._bm25_path = os.path.join(store.root, "bm25.npz")
+        self._tfidf_dir = os.path.join(store.root, "tfidf")
+        self.quant = Int8Quantizer() if QUANT == "int8" else None
+        self._lock = threading.Lock()
+        self._training = False
+        self._s = self._new_state()
+        self._generation = -1
+        self._checked = 0.0
+
+    def _new_state(self) -> "_State":
+        return _State(self.store.epoch, np.int8 if self.quant else np.float32)
+
+    # the current state's fields, for callers outside the index
+    def __len__(self) -> int:
+        return self._s.n
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._view(self._s)
+
+    @property
+    def alive(self) -> np.ndarray:
+        st = self._s
+        return st.alive[:st.n]
+
+    @property
+    def by_id(self) -> Dict[str, int]:
+        return self._s.by_id
+
+    @property
+    def by_hash(self) -> Dict[str, int]:
+        return self._s.by_hash
+
+    @property
+    def postings(self) -> PostingsIndex:
+        return self._s.postings
+
+    @property
+    def bm25(self) -> BM25Index:
+        return self._s.bm25
+
+    @property
+    def tfidf(self) -> TfidfIndex:
+        return self._s.tfidf
+
+    @property
+    def ivf(self) -> Optional[IVFIndex]:
+        return self._s.ivf
+
+    @property
+    def deleted(self) -> int:
+        return self._s.deleted
+
+    def _view(self, st: "_State", n: Optional[int] = None):
+        n = st.n if n is None else n
+        if self.quant:
+            return Int8Matrix(st.M[:n], self.quant.scale)
+        return st.M[:n]
+
+    def refresh(self):
+        now = time.monotonic()
+        if self._generation == self.store.generation and now - self._checked < DISK_CHECK_SECS:
+            return
+        with self._lock:
+            generation = self.store.generation
+            self.store.reload()
+            st = self._s
+            if self.store.epoch != st.epoch:  # compacted: row numbering changed; readers keep the old state meanwhile
+                st = self._new_state()
+            dim = self.store.dim
+            if not st.loaded and dim and st.bm25.load(self._bm25_path, self._layout_ok):
+                st.bm25_saved = st.bm25.rows
+            if not st.loaded and dim and st.tfidf.load(self._tfidf_dir, self._layout_ok):
+                st.tfidf_saved = st.tfidf.rows
+            for seg in self.store.segments() if dim else []:
+                have, offset = st.loaded.get(seg, (0, 0))
+                rows = self.store.rows(seg)
+                if rows <= have: continue
+                offsets: List[int] = []
+                recs, offset = self.store.meta_from(seg, offset, rows - have, offsets)
+                n = len(recs)
+                if not n: continue
+                start = st.n
+                st.grow(start + n, dim)
+                st.starts.append((start, seg, have))  # before the lexical indexes can return these rows
+                st.runs.setdefault(seg, []).append((start, have, n))
+                V = self.store.vectors(seg)[have:have + n]
+                if self.quant:
+                    if not self.quant.fitted:
+                        self.quant.fit(V)
+                    V = self.quant.encode(V)
+                st.M[start:start + n] = V
+                st.alive[start:start + n] = True
+                st.off[start:start + n] = offsets
+                st.ids.extend(r.get("id") for r in recs)
+                st.hashes.extend(r.get("hash") for r in recs)
+                st.postings.add(recs, start)
+                st.bm25.add(recs, start)
+                st.tfidf.add(recs, start)
+                for i, r in enumerate(recs, start):
+                    if r.get("corrupt"):
+                        st.alive[i] = False
+                        st.deleted += 1
+                        continue
+                    st.by_id[r["id"]] = i
+                    if r.get("hash"): st.by_hash.setdefault(r["hash"], i)
+                st.n += n  # last: readers only look at rows below ``n``
+                st.loaded[seg] = (have + n, offset)
+            self._apply_tombstones(st)
+            self._s = st
+            self._update_ann(st)
+            if st.n - min(st.bm25_saved, st.tfidf_saved) >= BM25_SAVE_ROWS:
+                self._save_snapshots(background=True)
+            self._generation = generation
+            self._checked = now
+
+    def _layout(self, st: "_State") -> List[List[Any]]:
+        return [[seg, st.loaded[seg][0]] for seg in self.store.segments() if seg in st.loaded]
+
+    def _layout_ok(self, layout: List[List[Any]]) -> bool:
+        """A snapshot's rows still line up if its segments are a prefix of ours with the same row counts."""
+        segs = self.store.segments()
+        if len(layout) > len(segs) or any(seg != s for (seg, _), s in zip(layout, segs)):
+            return False
+        return all(self.store.rows(seg) == n for seg, n in layout[:-1]) and \
+            all(self.store.rows(seg) >= n for seg, n in layout[-1:])
+
+    def _save_snapshots(self, background: bool = False):
+        st = self._s
+        layout, upto = self._layout(st), st.n
+        jobs = []
+        if upto > st.bm25_saved:
+            st.bm25_saved = upto
+            jobs.append((st.bm25.save, self._bm25_path))
+        if upto > st.tfidf_saved:
+            st.tfidf_saved = upto
+            jobs.append((st.tfidf.save, self._tfidf_dir))
+        for save, path in jobs:
+            if background:
+                threading.Thread(target=save, args=(path, layout, upto), daemon=True).start()
+            else:
+                save(path, layout, upto)
+
+    @staticmethod
+    def _lexical_mask(st: "_State", filters: Dict[str, Any]) -> Optional[np.ndarray]:
+        n = st.n
+        rows = st.postings.select(**filters)
+        if rows is None and not st.deleted:
+            return None
+        mask = st.alive[:n].copy() if st.deleted else np.ones(n, dtype=bool)
+        if rows is not None:
+            sel = np.zeros(n, dtype=bool)
+            sel[rows[rows < n]] = True
+            mask &= sel
+        return mask
+
+    def keyword_search(self, q: str, limit: int, **filters: Any) -> List[Tuple[float, Dict[str, Any]]]:
+        """BM25 top-``limit`` as ``(score, metadata)`` pairs, with the same filters as ``search``."""
+        self.refresh()
+        st = self._s
+        ids, scores = st.bm25.search(q, limit, self._lexical_mask(st, filters))
+        return list(zip(map(float, scores), self.records(ids, st)))
+
+    def tfidf_search(self, q: str, limit: int, **filters: Any) -> List[Tuple[float, Dict[str, Any]]]:
+        """TF-IDF cosine top-``limit`` as ``(score, metadata)`` pairs, with the same filters as ``search``."""
+        self.refresh()
+        st = self._s
+        ids, scores = st.tfidf.search(q, limit, self._lexical_mask(st, filters))
+        return list(zip(map(float, scores), self.records(ids, st)))
+
+    def records(self, rows, st: Optional["_State"] = None) -> List[Dict[str, Any]]:
+        """Full metadata for global rows of ``st`` (default: the current state), read from
+        the segment files (one open per segment)."""
+        st = st or self._s
+        rows = np.asarray(rows, dtype=np.int64)
+        out: List[Dict[str, Any]] = [{}] * len(rows)
+        if not len(rows):
+            return out
+        for seg, ks in st.by_segment(rows).items():
+            for k, rec in zip(ks, self.store.meta_at(seg, st.off[rows[ks]].tolist())):
+                out[k] = rec if rec is not None else {"id": st.ids[rows[k]]}
+        if any(len(r) == 1 for r in out) and st.epoch == self._s.epoch:
+            self._checked = 0.0  # segment compacted away: pick up the new layout now
+            self.refresh()
+        cur = self._s
+        gone = [k for k, r in enumerate(out) if len(r) == 1 and cur is not st and r["id"] in cur.by_id]
+        if gone:  # same rows at their new location
+            for k, rec in zip(gone, self.records([cur.by_id[out[k]["id"]] for k in gone], cur)):
+                out[k] = rec
+        return out
+
+    def _apply_tombstones(self, st: "_State"):
+        new, st.tomb_offset = self.store.tombstones_from(st.tomb_offset)
+        pending: List[Dict[str, Any]] = []
+        for t in st.tomb_pending + new:
+            row = st.global_row(t["seg"], t["row"])
+            if row is None:  # row written by another process and not loaded yet
+                pending.append(t)
+                continue
+            if not st.alive[row]: continue
+            st.alive[row] = False
+            st.deleted += 1
+            if st.by_id.get(t["id"]) == row: del st.by_id[t["id"]]
+            h = st.hashes[row]
+            if h and st.by_hash.get(h) == row: del st.by_hash[h]
+        st.tomb_pending = pending
+
+    def delete(self, ids) -> int:
+        """Tombstone the live rows with these ids; returns how many were deleted."""
+        ids = set(ids)
+        while True:
+            self.refresh()
+            with self._lock:
+                st = self._s
+                rows = [(i, *st.locate(st.by_id[i])) for i in ids if i in st.by_id]
+            n = self.store.delete(rows, st.epoch)
+            if n >= 0: break  # else a compaction moved the rows meanwhile; locate them again
+            self._checked = 0.0  # re-read the manifest now, not after DISK_CHECK_SECS
+        self.refresh()
+        return n
+
+    def ids_where(self, **filters: Any) -> List[str]:
+        """Ids of the live rows matching metadata filters (``url=``, ``filename=``, ...)."""
+        self.refresh()
+        st = self._s
+        rows = st.postings.select(**filters)
+        if rows is None:
+            return []
+        rows = rows[rows < st.n]
+        return [st.ids[i] for i in rows[st.alive[rows]].tolist()]
+
+    def _update_ann(self, st: "_State"):
+        n = st.n
+        if ANN_MIN_ROWS <= 0 or n < ANN_MIN_ROWS:
+            return
+        if st.ivf is not None and st.ivf.rows < n:
+            st.ivf.add(self._view(st, n)[st.ivf.rows:n], st.ivf.rows)
+        if not self._training and (st.ivf is None or st.ivf.needs_retrain(n)):
+            self._training = True
+            threading.Thread(target=self._train_ann, args=(st, self._view(st, n)), daemon=True).start()
+
+    def _train_ann(self, st: "_State", M: np.ndarray):
+        try:
+            ivf = IVFIndex()
+            ivf.train(M)
+            with self._lock:
+                if st is not self._s:
+                    return  # trained on rows numbered before a compaction
+                if ivf.rows < st.n:
+                    ivf.add(self._view(st)[ivf.rows:st.n], ivf.rows)
+                st.ivf = ivf
+        finally:
+            self._training = False
+
+    def search(self, qv, limit: int, nprobe: Optional[int] = None, **filters: Any) -> List[Tuple[float, Dict[str, Any]]]:
+        """Cosine top-``limit`` as ``(score, metadata)`` pairs.
+
+        ``filters`` are metadata equality filters (``industry=``, ``stage=``, ``tags=[...]``,
+        ...). Uses the IVF index when one is built and the filter is not selective;
+        ``nprobe`` overrides the number of probed lists and ``nprobe=0`` forces exact search.
+        """
+        self.refresh()
+        st = self._s
+        M = self._view(st)
+        if not len(M) or limit <= 0:
+            return []
+        q = np.array(qv, dtype="float32")
+        q /= (np.linalg.norm(q) + 1e-8)
+        ids, scores = self._candidates(st, M, q, self._pool(limit), nprobe, filters)
+        return self._finish(st, ids, scores, q, limit)
+
+    def search_batch(self, qvs, limits: List[int], filters: List[Dict[str, Any]],
+                     nprobes: Optional[List[Optional[int]]] = None, group: int = 16) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """Many queries at once; unfiltered exact queries share one ``M @ Q.T`` per group."""
+        self.refresh()
+        st = self._s
+        M = self._view(st)
+        n = len(M)
+        if not n or not len(qvs):
+            return [[] for _ in limits]
+        Q = np.array(qvs, dtype="float32")
+        Q /= (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-8)
+        nprobes = nprobes or [None] * len(Q)
+        cands: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        dense = [j for j, f in enumerate(filters) if not any(f.values()) and (st.ivf is None or nprobes[j] == 0)]
+        for g in range(0, len(dense), group):
+            js = dense[g:g + group]
+            S = M @ Q[js].T
+            if st.deleted:
+                S[~st.alive[:n]] = -np.inf
+            for c, j in enumerate(js):
+                ids = topk(S[:, c], self._pool(limits[j]))
+                cands[j] = (ids, S[ids, c])
+        for j in range(len(Q)):
+            if j not in cands:
+                cands[j] = self._candidates(st, M, Q[j], self._pool(limits[j]), nprobes[j], filters[j])
+        return [self._finish(st, *cands[j], Q[j], limits[j]) for j in range(len(Q))]
+
+    def _pool(self, limit: int) -> int:
+        return max(limit * QUANT_RERANK, 32) if self.quant else limit
+
+    def _finish(self, st: "_State", ids: np.ndarray, scores: np.ndarray, q: np.ndarray, limit: int) -> List[Tuple[float, Dict[str, Any]]]:
+        if limit <= 0:
+            return []
+        if st.deleted:
+            keep = st.alive[ids]
+            ids, scores = ids[keep], scores[keep]
+        if self.quant and len(ids):
+            scores = self.exact_rows(ids, st) @ q
+            top = topk(scores, limit)
+            ids, scores = ids[top], scores[top]
+        return list(zip(map(float, scores), self.records(ids, st)))
+
+    @staticmethod
+    def _candidates(st: "_State", M, q: np.ndarray, limit: int, nprobe: Optional[int], filters: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(M)
+        rows = st.postings.select(**filters)
+        if rows is not None:
+            rows = rows[rows < n]
+            if st.deleted:
+                rows = rows[st.alive[rows]]
+        ivf = st.ivf
+        if ivf is not None and nprobe != 0 and (rows is None or len(rows) > n // 10):
+            mask = st.alive[:n].copy() if st.deleted else None
+            if rows is not None:
+                mask = np.zeros(n, dtype=bool)
+                mask[rows] = True
+            ids, scores = ivf.search(M, q, limit, nprobe or ANN_NPROBE, mask)
+        elif rows is not None:
+            scores = M[rows] @ q
+            top = topk(scores, limit)
+            ids, scores = rows[top], scores[top]
+        else:
+            scores = M @ q
+            if st.deleted:
+                scores[~st.alive[:n]] = -np.inf
+            ids = topk(scores, limit)
+            scores = scores[ids]
+        return ids, scores
+
+    def vectors_for_hashes(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Stored (normalized) vectors for the content hashes already in the corpus."""
+        self.refresh()
+        st = self._s
+        found = {h: st.by_hash[h] for h in hashes if h in st.by_hash}
+        if not found:
+            return {}
+        rows = np.fromiter(found.values(), dtype=np.int64, count=len(found))
+        V = self.exact_rows(rows, st) if self.quant else self._view(st)[rows]
+        return dict(zip(found.keys(), V))
+
+    def exact_rows(self, ids: np.ndarray, st: Optional["_State"] = None) -> np.ndarray:
+        """Float32 vectors for global row ids, gathered from the mapped segments (from the
+        int8 codes for a segment a compaction has just removed)."""
+        st = st or self._s
+        out = np.empty((len(ids), st.M.shape[1]), dtype="float32")
+        for seg, sel in st.by_segment(ids).items():
+            sel = np.asarray(sel)
+            start, _, seg_row = st.starts[st.run_of(int(ids[sel[0]]))]
+            V = self.store.vectors(seg)
+            rows = ids[sel] - start + seg_row
+            out[sel] = V[rows] if len(V) > rows.max() else self._view(st)[ids[sel]]
+        return out
+
+class _State:
+    """Row-numbered contents of the index for one store epoch."""
+
+    def __init__(self, epoch: int, dtype):
+        self.epoch = epoch
+        self.n = 0  # rows loaded; readers never look past it
+        self.ids: List[Optional[str]] = []     # row -> id (None: corrupt line)
+        self.hashes: List[Optional[str]] = []  # row -> content hash
+        self.off = np.zeros(0, dtype=np.int64)  # row -> metadata byte offset in its segment
+        self.M = np.zeros((0, 0), dtype=dtype)
+        self.alive = np.zeros(0, dtype=bool)
+        self.deleted = 0
+        self.postings = PostingsIndex()
+        self.bm25 = BM25Index()
+        self.bm25_saved = 0
+        self.tfidf = TfidfIndex()
+        self.tfidf_saved = 0
+        self.by_id: Dict[str, int] = {}
+        self.by_hash: Dict[str, int] = {}
+        self.tomb_offset = 0
+        self.tomb_pending: List[Dict[str, Any]] = []
+        self.loaded: Dict[str, Tuple[int, int]] = {}  # segment -> (rows, meta byte offset)
+        self.starts: List[Tuple[int, str, int]] = []  # (global row, segment, segment row) per loaded run
+        self.runs: Dict[str, List[Tuple[int, int, int]]] = {}  # segment -> (global row, segment row, rows) runs
+        self.ivf: Optional[IVFIndex] = None
+
+    def grow(self, n: int, dim: int):
+        """Room for ``n`` rows; rows below ``self.n`` are copied before the arrays are swapped."""
+        if self.M.shape[1] != dim:
+            self.M = np.zeros((0, dim), dtype=self.M.dtype)
+        if n > self.M.shape[0]:
+            cap = max(n, 2 * self.M.shape[0], 1024)
+            M = np.empty((cap, dim), dtype=self.M.dtype)
+            M[:self.n] = self.M[:self.n]
+            off = np.zeros(cap, dtype=np.int64)
+            off[:self.n] = self.off[:self.n]
+            alive = np.zeros(cap, dtype=bool)
+            alive[:self.n] = self.alive[:self.n]
+            self.M, self.off, self.alive = M, off, alive
+
+    def run_of(self, row: int) -> int:
+        return bisect.bisect_right(self.starts, row, key=lambda s: s[0]) - 1
+
+    def locate(self, row: int) -> Tuple[str, int]:
+        start, seg, seg_row = self.starts[self.run_of(row)]
+        return seg, seg_row + row - start
+
+    def global_row(self, seg: str, seg_row: int) -> Optional[int]:
+        for start, first, n in self.runs.get(seg, ()):
+            if first <= seg_row < first + n:
+                return start + seg_row - first
+        return None
+
+    def by_segment(self, rows: np.ndarray) -> Dict[str, List[int]]:
+        """Positions in ``rows`` grouped by the segment each row lives in."""
+        starts = np.asarray([s[0] for s in self.starts])
+        run = np.searchsorted(starts, rows, side="right") - 1
+        out: Dict[str, List[int]] = {}
+        for k, r in enumerate(run.tolist()):
+            out.setdefault(self.starts[r][1], []).append(k)
+        return out
+
+INDEX = CorpusIndex(STORE)
+atexit.register(INDEX._save_snapshots)
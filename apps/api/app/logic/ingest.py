@@ -0,0 +1,377 @@
+from __future__ import annotations
+import os, re, uuid, queue, codecs, contextlib, shutil, signal, hashlib, tempfile, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+EMBED_BATCH = int(os.environ.get("RAG_EMBED_BATCH", "64"))
+QUEUE_DEPTH = int(os.environ.get("RAG_INGEST_QUEUE_DEPTH", "2"))
+READ_BLOCK = 1 << 20
+# PDF text extraction: worker processes, seconds allowed per page, pages per task,
+# and the page count below which a PDF is extracted in-process
+PDF_WORKERS = int(os.environ.get("RAG_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGE_TIMEOUT = float(os.environ.get("RAG_PDF_PAGE_TIMEOUT", "20"))
+PDF_PAGES_PER_TASK = int(os.environ.get("RAG_PDF_PAGES_PER_TASK", "8"))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("RAG_PDF_PARALLEL_MIN_PAGES", "16"))
+# Chunk size in estimated tokens (word/punctuation count; the default embedder truncates
+# at 512 wordpieces, so this leaves room for subword splits) and the overlap budget
+# filled with whole trailing sentences of the previous chunk
+CHUNK_TOKENS = int(os.environ.get("RAG_CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("RAG_CHUNK_OVERLAP_TOKENS", "32"))
+
+Piece = Union[str, Tuple[str, int]]  # text, optionally with its 1-based page number
+
+class Chunk(str):
+    """Chunk text plus its ``(start, end)`` offsets into the cleaned source and, for
+    paged sources, the first and last page it spans."""
+    span: Tuple[int, int]
+    pages: Optional[Tuple[int, int]]
+
+    def __new__(cls, text: str, span: Tuple[int, int], pages: Optional[Tuple[int, int]] = None):
+        obj = super().__new__(cls, text)
+        obj.span, obj.pages = span, pages
+        return obj
+
+# Namespace for deterministic chunk ids (also used as Qdrant point ids)
+CHUNK_NS = uuid.UUID("6f1c7a52-3b0e-4d55-9a51-2f2d0c3e8b17")
+
+def chunk_hash(text: str, model: str) -> str:
+    """Content address of a chunk: same normalized text + model => same embedding."""
+    norm = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(f"{model}\x00{norm}".encode("utf-8")).hexdigest()
+
+def chunk_id(content_hash: str, origin: str) -> str:
+    """Stable record id for a chunk from a given source (url/filename); re-ingest upserts in place."""
+    return str(uuid.uuid5(CHUNK_NS, f"{content_hash}\x00{origin}"))
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+_POLL = 0.1  # seconds a stage thread waits on a queue before re-checking for a stop
+
+def _put(q: "queue.Queue[Any]", x: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(x, timeout=_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _pump(it: Iterator[Any], q: "queue.Queue[Any]", stop: threading.Event):
+    try:
+        for x in it:
+            if not _put(q, x, stop): return
+    except BaseException as e:
+        _put(q, _Failed(e), stop)
+        return
+    finally:
+        close = getattr(it, "close", None)
+        if close: close()  # runs the stage's own cleanup (temp files, ...) on this thread
+    _put(q, _DONE, stop)
+
+def _drain(q: "queue.Queue[Any]", stop: threading.Event) -> Iterator[Any]:
+    while not stop.is_set():
+        try:
+            x = q.get(timeout=_POLL)
+        except queue.Empty:
+            continue
+        if x is _DONE: return
+        if isinstance(x, _Failed): raise x.exc
+        yield x
+
+def staged(source: Iterable[Any], *stages: Callable[[Iterator[Any]], Iterator[Any]], depth: int = QUEUE_DEPTH) -> Iterator[Any]:
+    """Chain generator stages, each upstream one on its own thread behind a bounded queue.
+
+    A full queue blocks its producer, so a slow consumer (embedding, writing) holds
+    back extraction instead of letting it buffer the whole document. Exceptions
+    raised upstream re-raise in the consumer. When the consumer stops early (raises,
+    or closes the generator) every stage thread is told to stop and the queues are
+    emptied, so no producer stays blocked on a full queue.
+    """
+    stop = threading.Event()
+    queues: List["queue.Queue[Any]"] = []
+    it = iter(source)
+    for stage in stages:
+        q: "queue.Queue[Any]" = queue.Queue(maxsize=depth)
+        threading.Thread(target=_pump, args=(it, q, stop), daemon=True).start()
+        queues.append(q)
+        it = stage(_drain(q, stop))
+    try:
+        yield from it
+    finally:
+        stop.set()
+        close = getattr(it, "close", None)
+        if close: close()
+        for q in queues:
+            with contextlib.suppress(queue.Empty):
+                while True: q.get_nowait()
+
+def iter_text(f: BinaryIO, encoding: str = "utf-8") -> Iterator[str]:
+    """Decode a binary stream block by block (multi-byte sequences may straddle blocks)."""
+    dec = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    while True:
+        block = f.read(READ_BLOCK)
+        if not block:
+            tail = dec.decode(b"", final=True)
+            if tail: yield tail
+            return
+        yield dec.decode(block)
+
+class _PageTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise _PageTimeout()
+
+def _pdf_pages(path: str, start: int, end: int, timeout: float) -> List[Tuple[str, Optional[str]]]:
+    """Text of pages ``[start, end)`` as ``(text, error)``; runs in a worker process.
+
+    Each page gets ``timeout`` seconds (``SIGALRM``, so only when running on a
+    process's main thread); a page that times out or fails comes back empty.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    alarm = timeout > 0 and threading.current_thread() is threading.main_thread()
+    old = signal.signal(signal.SIGALRM, _raise_timeout) if alarm else None
+    out: List[Tuple[str, Optional[str]]] = []
+    try:
+        for k in range(start, end):
+            if alarm: signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                out.append((reader.pages[k].extract_text() or "", None))
+            except _PageTimeout:
+                out.append(("", f"timed out after {timeout:g}s"))
+            except Exception as e:
+                out.append(("", str(e) or type(e).__name__))
+            finally:
+                if alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        if alarm: signal.signal(signal.SIGALRM, old)
+    return out
+
+_PDF_POOL: Optional[ProcessPoolExecutor] = None
+_PDF_POOL_LOCK = threading.Lock()
+
+def _pdf_pool(reset: bool = False) -> ProcessPoolExecutor:
+    # spawn, not fork: the API process is multi-threaded
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if reset and _PDF_POOL is not None:
+            _PDF_POOL.shutdown(wait=False, cancel_futures=True)
+            _PDF_POOL = None
+        if _PDF_POOL is None:
+            _PDF_POOL = ProcessPoolExecutor(PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _PDF_POOL
+
+def _as_path(f: BinaryIO) -> Tuple[str, Optional[str]]:
+    """A filesystem path for ``f`` (worker processes reopen it); copies to a temp file if needed."""
+    name = getattr(f, "name", None)
+    if isinstance(name, str) and os.path.isfile(name) and f.tell() == 0:
+        return name, None
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(f, tmp, READ_BLOCK)
+    return tmp.name, tmp.name
+
+def iter_pdf_pages(f: BinaryIO, errors: Optional[List[Tuple[int, str]]] = None) -> Iterator[Tuple[str, int]]:
+    """``(text, page number)`` per page, in page order.
+
+    Past ``PDF_PARALLEL_MIN_PAGES`` pages, ranges of ``PDF_PAGES_PER_TASK`` pages are
+    extracted on a process pool with a bounded number of ranges in flight, and
+    yielded in order as they complete. Smaller PDFs are extracted in-process when
+    the per-page alarm can run there (main thread), else as one task on the pool,
+    so ``PDF_PAGE_TIMEOUT`` applies either way. Pages that time out or fail are
+    yielded empty and reported to ``errors`` as ``(page, reason)``.
+    """
+    from pypdf import PdfReader
+    path, tmp = _as_path(f)
+    try:
+        n = len(PdfReader(path).pages)
+        ranges = [(k, min(k + PDF_PAGES_PER_TASK, n)) for k in range(0, n, PDF_PAGES_PER_TASK)]
+        results: Iterator[Any]
+        if n >= PDF_PARALLEL_MIN_PAGES and PDF_WORKERS > 1:
+            results = _pdf_parallel(path, ranges)
+        elif PDF_PAGE_TIMEOUT <= 0 or threading.current_thread() is threading.main_thread():
+            results = (_pdf_pages(path, a, b, PDF_PAGE_TIMEOUT) for a, b in ranges)
+        else:  # SIGALRM only fires on a main thread: use a worker process's
+            results = _pdf_parallel(path, ranges if n >= PDF_PARALLEL_MIN_PAGES else [(0, n)])
+        page = 0
+        for texts in results:
+            for text, err in texts:
+                page += 1
+                if err and errors is not None: errors.append((page, err))
+                yield text, page
+    finally:
+        if tmp: os.remove(tmp)
+
+def _pdf_parallel(path: str, ranges: List[Tuple[int, int]]) -> Iterator[List[Tuple[str, Optional[str]]]]:
+    pool, window, futures = _pdf_pool(), 2 * PDF_WORKERS, []
+    todo = iter(ranges)
+    def submit():
+        r = next(todo, None)
+        if r is not None:
+            futures.append((r, pool.submit(_pdf_pages, path, r[0], r[1], PDF_PAGE_TIMEOUT)))
+    for _ in range(window):
+        submit()
+    try:
+        while futures:
+            (a, b), fut = futures.pop(0)
+            try:
+                # the in-worker alarm should fire first; this only guards against a wedged worker
+                texts = fut.result(timeout=PDF_PAGE_TIMEOUT * (b - a) + 30 if PDF_PAGE_TIMEOUT > 0 else None)
+            except FutureTimeout:
+                texts = [("", "worker timed out")] * (b - a)
+            except BrokenProcessPool:
+                pool = _pdf_pool(reset=True)
+                texts = [("", "worker crashed")] * (b - a)
+                futures = [(r, pool.submit(_pdf_pages, path, r[0], r[1], PDF_PAGE_TIMEOUT)) for r, _ in futures]
+            submit()
+            yield texts
+    finally:  # closed early (ingest stopped): don't leave queued ranges for the pool
+        for _, fut in futures:
+            fut.cancel()
+
+_WS = re.compile(r"\s+")
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+# After cleaning, whitespace is a single space or a paragraph break. A sentence ends at
+# . ! or ? (optionally followed by closing quotes/brackets) before either.
+_BREAK = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"'\u201d\u2019)\]]))(?: |\n\n)|\n\n")
+TRIM_CHARS = 1 << 16
+
+def _clean(text: str) -> str:
+    return _WS.sub(lambda m: "\n\n" if m.group().count("\n") > 1 else " ", text)
+
+def stream_chunks(pieces: Iterable[Piece], max_tokens: int = CHUNK_TOKENS,
+                  overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """Single pass over a stream of text pieces, packing whole sentences into chunks.
+
+    Whitespace is collapsed (blank lines are kept as paragraph breaks) and sentences
+    are tracked as offsets into one rolling buffer; a chunk is only sliced out when
+    it is emitted. Sentences are added until the next would exceed ``max_tokens``;
+    the next chunk starts with the trailing sentences that fit in ``overlap`` tokens.
+    A paragraph break closes a chunk that is at least half full (without overlap),
+    and a single sentence over budget is cut at token boundaries. Pieces given as
+    ``(text, page)`` yield chunks carrying the page range they span.
+    """
+    buf, base = "", 0  # buf holds cleaned text from absolute offset ``base``
+    carry = ""  # trailing raw whitespace, cleaned with the next piece
+    marks: List[Tuple[int, int]] = []  # (absolute offset where a page starts, page)
+    cur: List[Tuple[int, int, int]] = []  # (start, end, tokens) of sentences in the open chunk
+    cur_tokens = fresh = 0  # fresh = sentences in ``cur`` not yet part of an emitted chunk
+    sent = 0  # absolute start of the sentence being scanned
+
+    def tokens(start: int, end: int) -> int:
+        return sum(1 for _ in _TOKEN.finditer(buf, start - base, end - base))
+
+    def chunk(start: int, end: int) -> Chunk:
+        pages = None
+        if marks:
+            inside = [pg for pos, pg in marks if pos < end]
+            before = [pg for pos, pg in marks if pos <= start]
+            pages = (before[-1] if before else inside[0], inside[-1]) if inside else None
+        return Chunk(buf[start - base:end - base], (start, end), pages)
+
+    def close(keep: int) -> Iterator[Chunk]:
+        nonlocal cur, cur_tokens, fresh
+        if fresh:
+            yield chunk(cur[0][0], cur[-1][1])
+        tail: List[Tuple[int, int, int]] = []
+        n = 0
+        for s in reversed(cur):
+            if n + s[2] > keep: break
+            tail.insert(0, s)
+            n += s[2]
+        cur, cur_tokens, fresh = tail, n, 0
+
+    def add(start: int, end: int, para: bool) -> Iterator[Chunk]:
+        nonlocal cur, cur_tokens, fresh
+        if start >= end: return
+        n = tokens(start, end)
+        if n > max_tokens:  # one long "sentence": hard cuts at token boundaries
+            yield from close(0)
+            k, cut = 0, None
+            for m in _TOKEN.finditer(buf, start - base, end - base):
+                if cut is None: cut = base + m.start()
+                k += 1
+                if k == max_tokens:
+                    yield chunk(cut, base + m.end())
+                    k, cut = 0, None
+            if cut is not None:
+                cur, cur_tokens, fresh = [(cut, end, k)], k, 1
+        else:
+            if cur_tokens + n > max_tokens:
+                yield from close(min(overlap, max_tokens - n))
+            cur.append((start, end, n))
+            cur_tokens += n
+            fresh += 1
+        if para and 2 * cur_tokens >= max_tokens:
+            yield from close(0)
+
+    for piece in pieces:
+        if isinstance(piece, tuple):
+            piece, page = piece
+            if buf and not carry and piece[:1].strip():
+                carry = " "  # pages are separate text runs
+            marks.append((base + len(buf), page))
+        raw = carry + piece
+        body = raw.rstrip()
+        carry = raw[len(body):]
+        if not buf: body = body.lstrip()
+        if not body: continue
+        scan = len(buf)
+        buf += _clean(body)
+        for m in _BREAK.finditer(buf, scan):
+            yield from add(sent, base + m.start(), m.group() == "\n\n")
+            sent = base + m.end()
+        keep = min(cur[0][0] if cur else sent, sent) - base
+        if keep > TRIM_CHARS:
+            buf, base = buf[keep:], base + keep
+            marks = marks[max(0, max((k for k, (pos, _) in enumerate(marks) if pos <= base), default=0)):]
+    yield from add(sent, base + len(buf), True)
+    if fresh:
+        yield from close(0)
+
+def _batched(it: Iterable[str], n: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for x in it:
+        batch.append(x)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _noop(stage: str, n: int):
+    pass
+
+def run_ingest(pieces: Iterable[Piece], embed: Callable[[List[str]], List[Any]],
+               write: Callable[[List[str], List[Any]], int], batch: int = EMBED_BATCH,
+               progress: Callable[[str, int], None] = _noop) -> Tuple[int, int]:
+    """extract → chunk → embed micro-batches → write, as a bounded three-thread pipeline.
+
+    Each micro-batch is written (and becomes searchable) as soon as it is embedded;
+    ``progress(stage, n)`` is told about every batch as it clears ``extracted``,
+    ``embedded`` and ``written``. Returns ``(chunks, written)``.
+    """
+    chunks = 0
+    def extract_stage() -> Iterator[List[str]]:
+        for texts in _batched(stream_chunks(pieces), batch):
+            progress("extracted", len(texts))
+            yield texts
+    def embed_stage(batches: Iterator[List[str]]) -> Iterator[Tuple[List[str], List[Any]]]:
+        nonlocal chunks
+        for texts in batches:
+            chunks += len(texts)
+            vecs = embed(texts)
+            progress("embedded", len(vecs))
+            yield texts, vecs
+    written = 0
+    with contextlib.closing(staged(extract_stage(), embed_stage, iter)) as batches:
+        for texts, vecs in batches:
+            n = write(texts, vecs)
+            progress("written", n)
+            written += n
+    return chunks, written
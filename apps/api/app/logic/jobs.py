@@ -0,0 +1,248 @@
+from __future__ import annotations
+import os, json, time, uuid, queue, fcntl, threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+JOB_WORKERS = int(os.environ.get("RAG_JOB_WORKERS", "2"))
+# Finished (done/failed) jobs are deleted once older than this many seconds, or past
+# the newest JOB_KEEP; pruning runs at most every JOB_PRUNE_SECS per process
+JOB_RETENTION_SECS = float(os.environ.get("RAG_JOB_RETENTION_SECS", str(7 * 86400)))
+JOB_KEEP = int(os.environ.get("RAG_JOB_KEEP", "1000"))
+JOB_PRUNE_SECS = 60.0
+FINISHED = ("done", "failed")
+
+Progress = Callable[[str, int], None]
+Handler = Callable[[Dict[str, Any], Optional[str], Progress], Dict[str, Any]]
+
+class JobQueue:
+    """Local, file-backed job queue for background ingestion.
+
+    Every job is ``<id>.json`` under ``JOBS_DIR`` (plus ``<id>.upload`` for file
+    payloads). A worker holds an exclusive ``flock`` on ``<id>.lock`` while running a
+    job, so after a crash or restart any process can tell orphaned ``queued``/``running``
+    jobs apart from ones still owned by a live worker and re-run them.
+
+    Per-kind status counts live in ``_stats.json``; every status change rewrites the
+    job file and the counts together under an ``flock`` of ``_stats.lock``, so
+    ``stats()`` never has to parse the job files.
+    """
+
+    def __init__(self, root: str = JOBS_DIR, workers: int = JOB_WORKERS):
+        self.root = root
+        self.workers = workers
+        os.makedirs(root, exist_ok=True)
+        self.handlers: Dict[str, Handler] = {}
+        self._q: "queue.Queue[str]" = queue.Queue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._pruned = 0.0
+
+    def register(self, kind: str, fn: Handler):
+        self.handlers[kind] = fn
+
+    def _path(self, job_id: str, ext: str = ".json") -> str:
+        return os.path.join(self.root, job_id + ext)
+
+    def upload_path(self, job_id: str) -> str:
+        return self._path(job_id, ".upload")
+
+    def _save(self, job: Dict[str, Any]):
+        tmp = self._path(job["id"], ".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["id"]))
+
+    def _files(self) -> "List[os.DirEntry[str]]":
+        """Job files, most recently written first."""
+        files = []
+        with os.scandir(self.root) as it:
+            for e in it:
+                if e.name.endswith(".json") and not e.name.startswith("_"):
+                    try:
+                        files.append((e.stat().st_mtime, e))
+                    except FileNotFoundError:  # pruned meanwhile
+                        pass
+        files.sort(key=lambda f: f[0], reverse=True)
+        return [e for _, e in files]
+
+    def _tally(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for e in self._files():
+            job = self._load(e.name[:-5])
+            if job: _move(counts, job["kind"], None, job["status"])
+        return counts
+
+    @contextmanager
+    def _counts(self, rebuild: bool = False):
+        """Status counts per kind, exclusive across processes; saved back on exit."""
+        with open(self._path("_stats", ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                counts = None if rebuild else self._read_counts()
+                if counts is None:
+                    counts = self._tally()
+                yield counts
+                tmp = self._path("_stats", ".json.tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(counts, f)
+                os.replace(tmp, self._path("_stats"))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_counts(self) -> Optional[Dict[str, Dict[str, int]]]:
+        try:
+            with open(self._path("_stats"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _set_status(self, job: Dict[str, Any], old: Optional[str], status: str):
+        with self._counts() as counts:
+            job["status"] = status
+            self._save(job)
+            _move(counts, job["kind"], old, status)
+
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, kind: str, params: Dict[str, Any], job_id: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in self.handlers:
+            raise KeyError(f"Unknown job kind '{kind}'")
+        job = {"id": job_id or self.new_id(), "kind": kind, "status": "queued", "params": params,
+               "progress": {"extracted": 0, "embedded": 0, "written": 0},
+               "created": time.time(), "started": None, "finished": None, "result": None, "error": None}
+        with self._lock:
+            self._jobs[job["id"]] = job
+        self._set_status(job, None, "queued")
+        self.start()
+        self._q.put(job["id"])
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The ``limit`` most recently updated jobs; only their files are read."""
+        return [j for j in (self.get(e.name[:-5]) for e in self._files()[:limit]) if j]
+
+    def pending(self, kind: str) -> int:
+        """Jobs of ``kind`` queued or running, in any process."""
+        counts = (self._read_counts() or {}).get(kind, {})
+        return counts.get("queued", 0) + counts.get("running", 0)
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+        self.prune()
+        with self._counts(rebuild=True):  # once per process: fix counts a crash left behind
+            pass
+        for job in sorted(self.list(limit=len(self._files())), key=lambda j: j["created"]):
+            if job["status"] in ("queued", "running") and job["id"] not in self._jobs:
+                self._q.put(job["id"])
+
+    def prune(self, force: bool = False) -> int:
+        """Delete finished jobs past the retention limits; returns how many."""
+        now = time.time()
+        if not force and time.monotonic() - self._pruned < JOB_PRUNE_SECS:
+            return 0
+        self._pruned = time.monotonic()
+        files = self._files()
+        old = [e for k, e in enumerate(files) if k >= JOB_KEEP or e.stat().st_mtime < now - JOB_RETENTION_SECS]
+        n = 0
+        if old:
+            with self._counts() as counts:
+                for e in old:
+                    job = self._load(e.name[:-5])
+                    if job is None or job["status"] not in FINISHED or job["id"] in self._jobs:
+                        continue
+                    try:
+                        os.remove(e.path)
+                    except FileNotFoundError:
+                        continue  # pruned by another process
+                    _move(counts, job["kind"], job["status"], None)
+                    n += 1
+        return n
+
+    def _worker(self):
+        while True:
+            job_id = self._q.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._q.task_done()
+
+    def _run(self, job_id: str):
+        with open(self._path(job_id, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                job = None  # another worker process owns it
+            else:
+                job = self._load(job_id)  # not our copy: a recovering process may have run it already
+            if job is None or job["status"] not in ("queued", "running"):
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+                return
+            with self._lock:
+                self._jobs[job_id] = job
+            job.update(started=time.time(), error=None)
+            job["progress"] = {"extracted": 0, "embedded": 0, "written": 0}
+            self._set_status(job, job["status"], "running")
+            last, save_lock = [0.0], threading.Lock()
+            def progress(stage: str, n: int):  # called from every pipeline stage's thread
+                with save_lock:
+                    job["progress"][stage] = job["progress"].get(stage, 0) + n
+                    if time.monotonic() - last[0] > 0.5:
+                        last[0] = time.monotonic()
+                        self._save(job)
+            upload = self.upload_path(job_id)
+            try:
+                job["result"] = self.handlers[job["kind"]](job["params"], upload if os.path.exists(upload) else None, progress)
+                status = "done"
+            except Exception as e:
+                status = "failed"
+                job["error"] = getattr(e, "detail", None) or str(e) or type(e).__name__
+            job["finished"] = time.time()
+            with save_lock:  # a late progress() save must not overwrite the final state
+                self._set_status(job, "running", status)
+            for path in (upload, self._path(job_id, ".lock")):
+                if os.path.exists(path):
+                    os.remove(path)
+            with self._lock:
+                self._jobs.pop(job_id, None)
+        self.prune()
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for by_status in (self._read_counts() or {}).values():
+            for status, n in by_status.items():
+                counts[status] = counts.get(status, 0) + n
+        return {"depth": self.depth(), "workers": self.workers, "running": sum(j["status"] == "running" for j in list(self._jobs.values())), "by_status": counts}
+
+def _move(counts: Dict[str, Dict[str, int]], kind: str, old: Optional[str], new: Optional[str]):
+    by_status = counts.setdefault(kind, {})
+    if old is not None:
+        by_status[old] = by_status.get(old, 0) - 1
+        if by_status[old] <= 0: del by_status[old]
+    if new is not None:
+        by_status[new] = by_status.get(new, 0) + 1
+
+JOBS = JobQueue()
@@ -0,0 +1,59 @@
+from __future__ import annotations
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+
+FIELDS = ("industry", "stage", "tags", "source", "url", "filename")
+
+class PostingsIndex:
+    """Per-field posting lists (sorted row ids) over chunk metadata.
+
+    Rows are only ever appended with increasing ids, so every list stays sorted and
+    an AND of filters is a chain of ``np.intersect1d`` calls starting from the
+    shortest list: cost follows the matching rows, not the corpus size.
+    """
+
+    def __init__(self, fields: Iterable[str] = FIELDS):
+        self.fields = tuple(fields)
+        self._arrays: Dict[str, Dict[str, np.ndarray]] = {f: {} for f in self.fields}
+        self._pending: Dict[str, Dict[str, List[int]]] = {f: {} for f in self.fields}
+        self._lock = threading.Lock()
+
+    def add(self, records: List[Dict[str, Any]], start: int):
+        with self._lock:
+            self._add(records, start)
+
+    def _add(self, records: List[Dict[str, Any]], start: int):
+        for i, r in enumerate(records, start):
+            for f in self.fields:
+                v = r.get(f)
+                for val in (v if isinstance(v, list) else [v]):
+                    if val is None or val == "": continue
+                    self._pending[f].setdefault(str(val), []).append(i)
+
+    def rows(self, field: str, value: Any) -> np.ndarray:
+        key = str(value)
+        with self._lock:
+            arr = self._arrays[field].get(key)
+            extra = self._pending[field].pop(key, None)
+            if extra:
+                arr = np.concatenate([arr, np.asarray(extra, dtype=np.int64)]) if arr is not None else np.asarray(extra, dtype=np.int64)
+                self._arrays[field][key] = arr
+        return arr if arr is not None else np.zeros(0, dtype=np.int64)
+
+    def select(self, **filters: Any) -> Optional[np.ndarray]:
+        """Row ids matching every given filter (lists mean all values), or None if unfiltered."""
+        lists = []
+        for f, v in filters.items():
+            if v is None or v == "" or v == []: continue
+            if f not in self._arrays:
+                raise KeyError(f"Unindexed filter field '{f}'")
+            lists += [self.rows(f, x) for x in (v if isinstance(v, (list, tuple, set)) else [v])]
+        if not lists:
+            return None
+        lists.sort(key=len)
+        out = lists[0]
+        for l in lists[1:]:
+            if not len(out): break
+            out = np.intersect1d(out, l, assume_unique=True)
+        return out
@@ -0,0 +1,261 @@
+from __future__ import annotations
+import hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+import numpy as np
+import scipy.sparse as sp
+from ..models.schema import Tree
+
+DEFAULT_WEIGHT = 0.2  # same default as the web client's computePropagation
+LINEAR = ("sum", "influences")  # child deltas add up, scaled by weight (a share / elasticity)
+LOG = ("product", "ratio")      # child growth factors multiply, raised to weight (an exponent)
+CACHE_SIZE = 32
+
+class CycleError(ValueError):
+    def __init__(self, cycle: List[str]):
+        super().__init__("Cycle in metric tree: " + " -> ".join(cycle + cycle[:1]))
+        self.cycle = cycle
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(s, s + c)`` for each pair, without a Python loop."""
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return shift + np.arange(total)
+
+class CompiledTree:
+    """A ``Tree`` flattened for vectorized evaluation.
+
+    Nodes are renumbered in topological order (leaves first, grouped by level, where
+    a node's level is one more than its deepest child's), and in-edges form a CSR
+    matrix over those rows: ``indptr``/``src``/``weight``, with ``log`` marking
+    ``product``/``ratio`` edges. Every node on a level depends only on lower levels,
+    so a level is one gather over its edge range plus one segmented sum.
+
+    Deltas are fractional changes (0.05 = +5%). A node's delta is its own delta plus
+    ``sum(weight * child)`` over linear edges; with multiplicative edges that total is
+    further scaled by ``prod((1 + child) ** weight)``. Unweighted edges default to
+    ``default_weight`` (``influences``), an equal share (``sum``), 1 (``product``),
+    and +1 for the first ``ratio`` child, -1 for the rest (numerator / denominators).
+    """
+
+    def __init__(self, tree: Tree, default_weight: float = DEFAULT_WEIGHT):
+        ids = list(dict.fromkeys([tree.north_star.id] + [n.id for n in tree.nodes]))
+        at = {i: k for k, i in enumerate(ids)}
+        missing = sorted({x for e in tree.edges for x in (e.src, e.dst) if x not in at})
+        if missing:
+            raise ValueError(f"Edges reference unknown nodes: {', '.join(missing[:10])}")
+        n = len(ids)
+        src = np.array([at[e.src] for e in tree.edges], dtype=np.int64)
+        dst = np.array([at[e.dst] for e in tree.edges], dtype=np.int64)
+        log = np.array([e.relation in LOG for e in tree.edges], dtype=bool)
+        weight = self._weights(tree, dst, default_weight)
+
+        level = self._levels(n, src, dst, ids)
+        order = np.argsort(level, kind="stable")  # topological: children before parents
+        pos = np.empty(n, dtype=np.int64)
+        pos[order] = np.arange(n)
+        self.ids = [ids[k] for k in order]
+        self.index: Dict[str, int] = {i: k for k, i in enumerate(self.ids)}
+        self.root = int(pos[0])
+        self.levels = np.searchsorted(level[order], np.arange(int(level.max(initial=0)) + 2))  # level -> first row
+
+        edges = np.lexsort((pos[src], pos[dst]))
+        self.edge_index = edges  # compiled edge -> position in tree.edges
+        self.src, self.dst = pos[src][edges], pos[dst][edges]
+        self.weight, self.log = weight[edges], log[edges]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.dst, minlength=n), out=self.indptr[1:])
+        self.has_log = bool(self.log.any())
+        self._level_blocks: Dict[Any, list] = {}
+        self._feeds_log = np.zeros(n, dtype=bool)  # rows whose log1p multiplicative parents need
+        self._feeds_log[self.src[self.log]] = True
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _weights(tree: Tree, dst: np.ndarray, default_weight: float) -> np.ndarray:
+        rel = [e.relation for e in tree.edges]
+        n_sum = np.bincount(dst[[r == "sum" for r in rel]], minlength=int(dst.max(initial=-1)) + 1)
+        first_ratio: set = set()
+        out = np.empty(len(rel), dtype=np.float64)
+        for k, (e, d) in enumerate(zip(tree.edges, dst.tolist())):
+            if e.weight is not None:
+                out[k] = e.weight
+            elif e.relation == "sum":
+                out[k] = 1.0 / n_sum[d]
+            elif e.relation == "product":
+                out[k] = 1.0
+            elif e.relation == "ratio":
+                out[k] = -1.0 if d in first_ratio else 1.0
+                first_ratio.add(d)
+            else:
+                out[k] = default_weight
+        return out
+
+    @staticmethod
+    def _levels(n: int, src: np.ndarray, dst: np.ndarray, ids: List[str]) -> np.ndarray:
+        """Kahn's algorithm one frontier at a time; raises ``CycleError`` if nodes are left over."""
+        out = np.argsort(src, kind="stable")
+        out_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=out_ptr[1:])
+        pending = np.bincount(dst, minlength=n)
+        level = np.zeros(n, dtype=np.int64)
+        frontier, lv, done = np.flatnonzero(pending == 0), 0, 0
+        while len(frontier):
+            level[frontier] = lv
+            done += len(frontier)
+            parents = dst[out[_ranges(out_ptr[frontier], out_ptr[frontier + 1] - out_ptr[frontier])]]
+            pending -= np.bincount(parents, minlength=n)
+            frontier = np.unique(parents[pending[parents] == 0])
+            lv += 1
+        if done < n:
+            raise CycleError(_find_cycle(pending > 0, src, dst, ids))
+        return level
+
+    def deltas(self, scenarios: Sequence[Mapping[str, float]], dtype=np.float64) -> np.ndarray:
+        """``(nodes, scenarios)`` matrix of own deltas, rows in compiled order."""
+        D = np.zeros((len(self.ids), len(scenarios)), dtype=dtype)
+        for s, m in enumerate(scenarios):
+            for node, v in m.items():
+                k = self.index.get(node)
+                if k is None:
+                    raise ValueError(f"Unknown node '{node}'.")
+                D[k, s] = v
+        return D
+
+    def _blocks(self, dtype) -> List[Tuple[int, int, int, int, sp.csr_matrix, Optional[Tuple[np.ndarray, sp.csr_matrix]]]]:
+        """Per level: row range, edge range, the linear weight block and, if the level has
+        multiplicative edges, the rows that have them with their exponent block (CSR)."""
+        dtype = np.dtype(dtype)
+        if dtype not in self._level_blocks:
+            blocks, n = [], len(self.ids)
+            for lv in range(1, len(self.levels) - 1):
+                a, b = int(self.levels[lv]), int(self.levels[lv + 1])
+                ea, eb = int(self.indptr[a]), int(self.indptr[b])
+                ptr, src = self.indptr[a:b + 1] - ea, self.src[ea:eb]
+                w, log = self.weight[ea:eb].astype(dtype), self.log[ea:eb]
+                # no stored zeros: mul must only read rows of LX that propagate fills in
+                lin = sp.csr_matrix((np.where(log, 0, w), src, ptr), shape=(b - a, n))
+                lin.eliminate_zeros()
+                mul = None
+                if log.any():
+                    rows = np.unique(self.dst[ea:eb][log]) - a
+                    mul = sp.csr_matrix((np.where(log, w, 0), src, ptr), shape=(b - a, n))[rows]
+                    mul.eliminate_zeros()
+                    mul = (rows, mul)
+                blocks.append((a, b, ea, eb, lin, mul))
+            self._level_blocks[dtype] = blocks
+        return self._level_blocks[dtype]
+
+    def propagate(self, D: np.ndarray, sampled: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                  inplace: bool = False) -> np.ndarray:
+        """Total deltas of every node for each column of ``D`` (own deltas, compiled order).
+
+        ``sampled = (edges, W)`` gives the listed edges (sorted, compiled order) their
+        own weight per scenario, one row of ``W`` each; they are applied as a
+        correction on top of the compiled weights. Work stays in ``D``'s dtype;
+        ``inplace`` overwrites ``D`` with the result instead of copying it.
+        """
+        X = D if inplace else D.copy()
+        feeds_log = self._feeds_log
+        LX = np.zeros_like(X) if self.has_log else None
+        if self.has_log:
+            LX[feeds_log] = np.log1p(np.maximum(X[feeds_log], -1 + 1e-6))
+        for a, b, ea, eb, lin, mul in self._blocks(X.dtype):
+            # rows a:b of X still hold their own deltas; lin/mul only read lower levels
+            val = X[a:b] + lin @ X
+            lg = mul[1] @ LX if mul is not None else None
+            if sampled is not None:
+                lo, hi = np.searchsorted(sampled[0], [ea, eb])
+                if hi > lo:
+                    e = sampled[0][lo:hi]
+                    dw = sampled[1][lo:hi] - self.weight[e, None].astype(X.dtype)
+                    rows, src, log = self.dst[e] - a, self.src[e], self.log[e]
+                    val += _scatter(rows[~log], dw[~log] * X[src[~log]], b - a)
+                    if log.any():
+                        where = np.searchsorted(mul[0], rows[log])
+                        lg += _scatter(where, dw[log] * LX[src[log]], len(mul[0]))
+            if lg is not None:
+                val[mul[0]] = (1 + val[mul[0]]) * np.exp(lg) - 1
+            X[a:b] = val
+            if self.has_log:
+                need = feeds_log[a:b]
+                LX[a:b][need] = np.log1p(np.maximum(val[need], -1 + 1e-6))
+        return X
+
+    def gains(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Local derivatives at total deltas ``x`` (one scenario, compiled order).
+
+        Returns ``own`` (d node / d its own delta, per node) and ``edge``
+        (d dst / d src, per compiled edge). Linear edges give ``weight`` times the
+        parent's multiplicative factor; multiplicative edges are linearized around
+        ``x``: ``weight * (1 + parent) / (1 + child)``. On all-linear trees these are
+        just the weights, so path products are exact contributions.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        own = np.ones(len(self.ids))
+        edge = self.weight.astype(np.float64)
+        if self.has_log:
+            one = 1 + np.maximum(x, -1 + 1e-6)
+            log = self.log
+            own = np.exp(np.bincount(self.dst[log], weights=self.weight[log] * np.log(one[self.src[log]]),
+                                     minlength=len(self.ids)))
+            edge = np.where(log, edge * one[self.dst] / one[self.src], edge * own[self.dst])
+        return own, edge
+
+    def adjoint(self, edge: np.ndarray, target: int) -> np.ndarray:
+        """d ``target`` / d node for every node, by one reverse sweep over the levels (O(edges)).
+
+        ``edge`` holds per-edge local derivatives (see ``gains``); nodes that do not
+        feed ``target`` get 0.
+        """
+        adj = np.zeros(len(self.ids))
+        adj[target] = 1.0
+        top = int(np.searchsorted(self.levels, target, side="right")) - 1
+        for lv in range(top, 0, -1):
+            ea, eb = int(self.indptr[self.levels[lv]]), int(self.indptr[self.levels[lv + 1]])
+            np.add.at(adj, self.src[ea:eb], adj[self.dst[ea:eb]] * edge[ea:eb])
+        return adj
+
+def _scatter(rows: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    """Row sums of ``values`` grouped into ``n`` output rows by ``rows`` (a sparse matmul)."""
+    inc = sp.csr_matrix((np.ones(len(rows), dtype=values.dtype), (rows, np.arange(len(rows)))), shape=(n, len(rows)))
+    return inc @ values
+
+_CACHE: "OrderedDict[str, CompiledTree]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+def tree_key(tree: Tree, default_weight: float = DEFAULT_WEIGHT) -> str:
+    """Content hash of a tree version (plus the default weight it is compiled with)."""
+    return hashlib.sha256(f"{default_weight!r}\x00{tree.model_dump_json()}".encode("utf-8")).hexdigest()
+
+def compile_tree(tree: Tree, default_weight: float = DEFAULT_WEIGHT, key: Optional[str] = None) -> CompiledTree:
+    """``CompiledTree`` for ``tree``, reused across calls while the tree is unchanged."""
+    key = key or tree_key(tree, default_weight)
+    with _CACHE_LOCK:
+        hit = _CACHE.get(key)
+        if hit is not None:
+            _CACHE.move_to_end(key)
+            return hit
+    compiled = CompiledTree(tree, default_weight)
+    with _CACHE_LOCK:
+        _CACHE[key] = compiled
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return compiled
+
+def _find_cycle(left: np.ndarray, src: np.ndarray, dst: np.ndarray, ids: List[str]) -> List[str]:
+    """One concrete cycle among the nodes Kahn's algorithm could not order."""
+    child = {}
+    for s, d in zip(src.tolist(), dst.tolist()):
+        if left[s] and left[d]:
+            child.setdefault(d, s)
+    node, seen = int(np.flatnonzero(left)[0]), {}
+    while node not in seen:
+        seen[node] = len(seen)
+        node = child[node]
+    path = list(seen)[seen[node]:]
+    return [ids[k] for k in reversed(path)]
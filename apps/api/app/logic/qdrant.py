@@ -0,0 +1,297 @@
+from __future__ import annotations
+import os, json, time, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+# Qdrant (optional)
+try:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http.models import (Distance, VectorParams, Filter, FieldCondition, MatchValue,
+                                           PointStruct, PointIdsList, QueryRequest)
+except Exception:
+    QdrantClient = None  # type: ignore
+    Distance = VectorParams = Filter = FieldCondition = MatchValue = PointStruct = PointIdsList = QueryRequest = None  # type: ignore
+
+QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")  # ":memory:" = embedded, in-process
+QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
+COLLECTION = os.environ.get("QDRANT_COLLECTION", "rag_chunks")
+QDRANT_TIMEOUT = int(os.environ.get("RAG_QDRANT_TIMEOUT", "5"))
+# Consecutive failures that open the breaker, and how long it stays open before one
+# probe call is let through (half-open)
+BREAKER_FAILURES = int(os.environ.get("RAG_QDRANT_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("RAG_QDRANT_BREAKER_COOLDOWN", "30"))
+
+# Bulk upserts: points per request, rough request-size cap, requests in flight, retries
+UPSERT_BATCH = int(os.environ.get("RAG_QDRANT_BATCH", "256"))
+UPSERT_BYTES = int(os.environ.get("RAG_QDRANT_BATCH_BYTES", str(4 << 20)))
+UPSERT_PARALLEL = int(os.environ.get("RAG_QDRANT_PARALLEL", "4"))
+UPSERT_RETRIES = int(os.environ.get("RAG_QDRANT_RETRIES", "3"))
+UPSERT_BACKOFF = float(os.environ.get("RAG_QDRANT_BACKOFF", "0.5"))
+
+T = TypeVar("T")
+
+class QdrantUnavailable(RuntimeError):
+    pass
+
+class Qdrant:
+    """One long-lived Qdrant connection shared by every router.
+
+    The client is created on first use and keeps its HTTP connection pool across
+    requests. Collection existence is checked once and cached. Every call goes
+    through a circuit breaker: after ``BREAKER_FAILURES`` consecutive errors the
+    client is dropped and calls fail immediately with ``QdrantUnavailable`` for
+    ``BREAKER_COOLDOWN`` seconds, so callers fall back to the local provider
+    instead of waiting out the timeout. After the cooldown the breaker is
+    half-open: exactly one call (the probe) reconnects while the others keep
+    failing fast; its success closes the breaker, its failure re-opens it.
+    """
+
+    def __init__(self, url: str = QDRANT_URL, api_key: Optional[str] = QDRANT_API_KEY,
+                 collection: str = COLLECTION, timeout: int = QDRANT_TIMEOUT):
+        self.url = url
+        self.api_key = api_key
+        self.collection = collection
+        self.timeout = timeout
+        self._client = None
+        self._collection_ok = False
+        self.failures = 0
+        self._open_until = 0.0  # 0: closed; else open until then, half-open after
+        self._probing = False
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def installed(self) -> bool:
+        return QdrantClient is not None
+
+    @property
+    def available(self) -> bool:
+        """Installed and a call would be let through (closed, or half-open with no probe out)."""
+        if not self.installed:
+            return False
+        return not self._open_until or (time.monotonic() >= self._open_until and not self._probing)
+
+    @property
+    def state(self) -> str:
+        if not self._open_until:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half-open"
+
+    def _kwargs(self) -> Dict[str, Any]:
+        if self.url == ":memory:":
+            return {"location": ":memory:"}
+        return {"url": self.url, "api_key": self.api_key, "timeout": self.timeout}
+
+    def client(self):
+        if self._client is None and self.installed:
+            with self._lock:
+                if self._client is None:
+                    self._client = QdrantClient(**self._kwargs())
+        return self._client
+
+    def _admit(self) -> bool:
+        """Let a call through or raise ``QdrantUnavailable``; True if it is the half-open probe."""
+        if not self.installed:
+            raise QdrantUnavailable("qdrant-client is not installed")
+        if not self._open_until:
+            return False
+        with self._lock:
+            if not self._open_until:
+                return False
+            if time.monotonic() < self._open_until:
+                raise QdrantUnavailable(f"circuit open: {self._error}")
+            if self._probing:
+                raise QdrantUnavailable(f"circuit half-open, probe in flight: {self._error}")
+            self._probing = True
+            return True
+
+    def _ok(self, probe: bool):
+        self.failures = 0
+        if probe:
+            with self._lock:
+                self._open_until, self._probing = 0.0, False
+
+    def _failed(self, e: BaseException, probe: bool):
+        with self._lock:
+            self.failures += 1
+            self._error = str(e) or type(e).__name__
+            if probe or self.failures >= BREAKER_FAILURES:
+                self._open_until = time.monotonic() + BREAKER_COOLDOWN
+                self._probing = False
+                self._collection_ok = False
+                # reconnect from scratch once the cooldown is over (the in-memory store must stay)
+                if self.url != ":memory:":
+                    self._client = None
+
+    def run(self, fn: Callable[[Any], T]) -> T:
+        """``fn(client)`` behind the breaker; raises ``QdrantUnavailable`` when it refuses the call."""
+        probe = self._admit()
+        try:
+            out = fn(self.client())
+        except BaseException as e:
+            self._failed(e, probe)
+            raise
+        self._ok(probe)
+        return out
+
+    def ensure_collection(self, dim: int) -> bool:
+        """Create the collection if missing; checked once per connection, then cached."""
+        if self._collection_ok:
+            return True
+        def check(c):
+            if not c.collection_exists(self.collection):
+                c.create_collection(self.collection, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+        try:
+            self.run(check)
+        except Exception:
+            return False
+        self._collection_ok = True
+        return True
+
+    def bootstrap(self, dim: Callable[[], Optional[int]]) -> None:
+        """Start-up check off the request path (a down server must not delay boot).
+
+        ``dim()`` gives the collection's vector size and may load the embedding model;
+        if it is unknown the collection is created by the first upsert instead.
+        """
+        def check():
+            n = dim()
+            if n: self.ensure_collection(n)
+        if self.installed:
+            threading.Thread(target=check, name="qdrant-bootstrap", daemon=True).start()
+
+    def search(self, vector, limit: int, flt=None) -> List[Any]:
+        return self.run(lambda c: c.query_points(self.collection, query=list(map(float, vector)), limit=limit,
+                                                 query_filter=flt, with_payload=True).points)
+
+    def search_batch(self, requests: List[Dict[str, Any]]) -> List[List[Any]]:
+        """``requests`` of ``{"vector", "limit", "filter"}``; one round trip for all of them."""
+        reqs = [QueryRequest(query=list(map(float, r["vector"])), limit=r["limit"], filter=r.get("filter"), with_payload=True)
+                for r in requests]
+        return [res.points for res in self.run(lambda c: c.query_batch_points(self.collection, requests=reqs))]
+
+    def upsert(self, records: List[Dict[str, Any]], wait: bool = True):
+        points = [PointStruct(id=r["id"], vector=list(map(float, r["vector"])),
+                              payload={k: v for k, v in r.items() if k != "vector"}) for r in records]
+        return self.run(lambda c: c.upsert(collection_name=self.collection, points=points, wait=wait))
+
+    def writer(self, **kw: Any) -> "UpsertWriter":
+        return UpsertWriter(self, **kw)
+
+    def delete(self, ids: List[str]):
+        return self.run(lambda c: c.delete(collection_name=self.collection, points_selector=PointIdsList(points=ids)))
+
+    def status(self) -> Dict[str, Any]:
+        open_for = max(0.0, self._open_until - time.monotonic())
+        return {"installed": self.installed, "url": self.url, "collection": self.collection,
+                "collection_ok": self._collection_ok, "breaker": self.state,
+                "open_for": round(open_for, 1), "failures": self.failures, "error": self._error}
+
+_UPSERT_POOL = ThreadPoolExecutor(max_workers=UPSERT_PARALLEL, thread_name_prefix="qdrant-upsert")
+
+def _size(r: Dict[str, Any]) -> int:
+    """Rough JSON size of a point: ~12 bytes per float plus the payload."""
+    return 12 * len(r["vector"]) + len(json.dumps({k: v for k, v in r.items() if k != "vector"}, ensure_ascii=False, default=str))
+
+class UpsertWriter:
+    """Streams records into Qdrant as size-bounded batches, ``parallel`` requests in flight.
+
+    ``add()`` buffers and hands every full batch to a shared pool without waiting,
+    so upserts overlap with embedding; at most ``parallel`` batches are queued or
+    in flight before ``add()`` blocks. Batches go out with ``wait=False`` (acked once
+    Qdrant has queued the update, not applied it) except the final one. Failed
+    batches are retried with exponential backoff (not once the breaker is open);
+    ``close()`` waits for every batch and returns the per-batch outcome.
+    """
+
+    def __init__(self, qdrant: Qdrant, batch: int = UPSERT_BATCH, max_bytes: int = UPSERT_BYTES,
+                 parallel: int = UPSERT_PARALLEL, retries: int = UPSERT_RETRIES, backoff: float = UPSERT_BACKOFF):
+        self.q = qdrant
+        self.batch, self.max_bytes, self.retries, self.backoff = batch, max_bytes, retries, backoff
+        self._slots = threading.BoundedSemaphore(parallel)
+        self._buf: List[Dict[str, Any]] = []
+        self._bytes = 0
+        self._futures: List[Future] = []
+        self._ready: Optional[bool] = None
+
+    def add(self, records: List[Dict[str, Any]]):
+        for r in records:
+            n = _size(r)
+            if self._buf and (len(self._buf) >= self.batch or self._bytes + n > self.max_bytes):
+                self._submit(wait=False)
+            self._buf.append(r)
+            self._bytes += n
+
+    def _submit(self, wait: bool):
+        if self._ready is None:
+            self._ready = self.q.available and self.q.ensure_collection(len(self._buf[0]["vector"]))
+        k, records = len(self._futures), self._buf
+        self._buf, self._bytes = [], 0
+        if not self._ready:
+            f: Future = Future()
+            f.set_result({"batch": k, "points": len(records), "ok": False, "attempts": 0, "error": "qdrant unavailable"})
+        else:
+            self._slots.acquire()
+            f = _UPSERT_POOL.submit(self._send, k, records, wait)
+            f.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(f)
+
+    def _send(self, k: int, records: List[Dict[str, Any]], wait: bool) -> Dict[str, Any]:
+        t = time.perf_counter()
+        out = {"batch": k, "points": len(records), "ok": False, "attempts": 0}
+        for attempt in range(self.retries + 1):
+            out["attempts"] = attempt + 1
+            try:
+                self.q.upsert(records, wait=wait)
+                out["ok"] = True
+                out.pop("error", None)
+                break
+            except QdrantUnavailable as e:
+                out["error"] = str(e)
+                break
+            except Exception as e:
+                out["error"] = str(e) or type(e).__name__
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        out["ms"] = round(1000 * (time.perf_counter() - t), 1)
+        return out
+
+    def close(self) -> Dict[str, Any]:
+        if self._buf:
+            self._submit(wait=True)
+        batches = [f.result() for f in self._futures]
+        return {"ok": all(b["ok"] for b in batches), "points": sum(b["points"] for b in batches if b["ok"]),
+                "failed": sum(b["points"] for b in batches if not b["ok"]), "batches": batches}
+
+def match_filter(filters: Dict[str, Any]):
+    """Metadata equality filters (list values: all must match) as a Qdrant ``Filter``."""
+    must = []
+    for k, v in filters.items():
+        for val in (v if isinstance(v, list) else [v]):
+            must.append(FieldCondition(key=k, match=MatchValue(value=val)))
+    return Filter(must=must) if must else None
+
+QDRANT = Qdrant()
+
+if __name__ == "__main__":
+    # throughput of bulk upserts: python -m app.logic.qdrant [points] [batch] [parallel]
+    import sys, uuid
+    import numpy as np
+    from .embedder import EMBEDDER
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else UPSERT_BATCH
+    parallel = int(sys.argv[3]) if len(sys.argv) > 3 else UPSERT_PARALLEL
+    q = Qdrant(collection=f"bench_{uuid.uuid4().hex[:8]}")
+    V = np.random.default_rng(0).standard_normal((n, EMBEDDER.dim or 384)).astype("float32")
+    w = q.writer(batch=batch, parallel=parallel)
+    t = time.perf_counter()
+    for i in range(0, n, 64):  # ingest-sized micro-batches
+        w.add([{"id": str(uuid.uuid4()), "vector": v, "text": "x" * 900} for v in V[i:i + 64]])
+    res = w.close()
+    dt = time.perf_counter() - t
+    print(json.dumps({"url": q.url, "points": res["points"], "failed": res["failed"], "batches": len(res["batches"]),
+                      "batch": batch, "parallel": parallel, "secs": round(dt, 2), "points_per_sec": round(res["points"] / dt)}))
+    try:
+        q.run(lambda c: c.delete_collection(q.collection))
+    except Exception:
+        pass
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from typing import Tuple
+import numpy as np
+
+class Int8Quantizer:
+    """Per-dimension symmetric int8 codes for unit-norm embeddings (4x smaller than float32).
+
+    ``scale[d]`` maps code 127 to the largest magnitude seen in dimension ``d`` when
+    fitted, floored at ``3/sqrt(dim)`` so a small first batch does not make later
+    rows saturate.
+    """
+
+    def __init__(self):
+        self.scale: np.ndarray = np.zeros(0, dtype="float32")
+
+    @property
+    def fitted(self) -> bool:
+        return len(self.scale) > 0
+
+    def fit(self, M: np.ndarray):
+        floor = 3.0 / np.sqrt(M.shape[1])
+        self.scale = (np.maximum(np.abs(M).max(axis=0), floor) / 127.0).astype("float32")
+
+    def encode(self, M: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(M / self.scale), -127, 127).astype(np.int8)
+
+class Int8Matrix:
+    """Read-only float view over int8 codes: row indexing dequantizes, ``@`` scores blockwise.
+
+    Quacks like the float32 corpus matrix for the places that consume it (exact
+    scoring, IVF training/probing, recall reports) without materializing floats.
+    """
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray, block: int = 65536):
+        self.codes = codes
+        self.scale = scale
+        self.block = block
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.codes.shape
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, idx) -> np.ndarray:
+        return self.codes[idx].astype("float32") * self.scale
+
+    def __matmul__(self, q: np.ndarray) -> np.ndarray:
+        q = np.asarray(q, dtype="float32")
+        qs = q * self.scale if q.ndim == 1 else q * self.scale[:, None]
+        out = np.empty((len(self.codes),) + q.shape[1:], dtype="float32")
+        for b in range(0, len(self.codes), self.block):
+            out[b:b + self.block] = self.codes[b:b + self.block].astype("float32") @ qs
+        return out
@@ -1,7 +1,7 @@
 from __future__ import annotations
-from typing import List, Dict, Any
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from typing import List, Dict, Any, Optional
+from .index import INDEX, CorpusIndex
+from .tfidf import TfidfIndex
 
 SEED_DOCS = [
     {"id":"tmpl_saas_01","text":"SaaS activation: FTUX completion increases retention. Measure activated_users / signups within 7 days. Improve with checklists and SSO."},
@@ -11,18 +11,30 @@ SEED_DOCS = [
 ]
 
 class SimpleRAG:
-    def __init__(self, docs: List[Dict[str,str]]):
+    """TF-IDF search over the seed templates plus the ingested corpus.
+
+    The seeds get a small in-memory ``TfidfIndex``; the corpus is served by the
+    persisted, incrementally updated ``index.tfidf``, so nothing is refitted at
+    start-up and new chunks are searchable as soon as they are stored.
+    """
+
+    def __init__(self, docs: List[Dict[str,str]], index: Optional[CorpusIndex] = None):
         self.ids = [d["id"] for d in docs]
         self.texts = [d["text"] for d in docs]
-        self.v = TfidfVectorizer(stop_words="english")
-        self.m = self.v.fit_transform(self.texts)
-    def search(self, q: str, k: int = 3) -> List[Dict[str, Any]]:
-        qv = self.v.transform([q])
-        sims = linear_kernel(qv, self.m).flatten()
-        idx = sims.argsort()[::-1][:k]
-        return [{"id": self.ids[i], "score": float(sims[i]), "text": self.texts[i]} for i in idx]
+        self.seeds = TfidfIndex(n_features=1 << 16)
+        self.seeds.add(docs, 0)
+        self.index = index
+    def search(self, q: str, k: int = 3, **filters: Any) -> List[Dict[str, Any]]:
+        hits = []
+        if not filters:  # seeds carry no metadata to filter on
+            rows, scores = self.seeds.search(q, k)
+            hits = [{"id": self.ids[i], "score": float(s), "text": self.texts[i]} for i, s in zip(rows.tolist(), scores)]
+        if self.index is not None:
+            hits += [{"id": r["id"], "score": s, "text": r.get("text"), "url": r.get("url"), "filename": r.get("filename")}
+                     for s, r in self.index.tfidf_search(q, k, **filters)]
+        return sorted(hits, key=lambda h: h["score"], reverse=True)[:k]
 
-RAG = SimpleRAG(SEED_DOCS)
+RAG = SimpleRAG(SEED_DOCS, INDEX)
 
-def rag_search(query: str, k: int = 3) -> List[Dict[str, Any]]:
-    return RAG.search(query, k=k)
+def rag_search(query: str, k: int = 3, **filters: Any) -> List[Dict[str, Any]]:
+    return RAG.search(query, k=k, **filters)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+import os, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+import numpy as np
+from ..models.schema import Tree
+from .propagate import CompiledTree
+
+SIM_BATCH = int(os.environ.get("SIM_BATCH", "8192"))  # draws propagated together
+SIM_WORKERS = int(os.environ.get("SIM_WORKERS", str(min(4, os.cpu_count() or 1))))
+SIM_POOL_MIN_DRAWS = int(os.environ.get("SIM_POOL_MIN_DRAWS", "250000"))  # shard across processes past this
+NODE_SAMPLE = int(os.environ.get("SIM_NODE_SAMPLE", "4096"))  # draws kept per node for its quantiles
+Z95 = 1.959963984540054
+
+DISTS = ("uniform", "normal", "triangular")
+
+class Spec:
+    """What varies between draws, in compiled order.
+
+    ``base`` holds the fixed own deltas. Each sampled input replaces its node's delta
+    with a draw from ``dist`` over ``[low, high]`` (``normal`` reads the range as a
+    95% interval; ``triangular`` peaks at ``mode``, default the midpoint). Each edge
+    with ``ci95`` gets a normal weight centred on its weight (or the interval
+    midpoint when it has none) with the interval's standard error.
+    """
+
+    def __init__(self, ct: CompiledTree, tree: Tree, deltas: Mapping[str, float],
+                 ranges: Mapping[str, Mapping[str, Any]]):
+        self.base = ct.deltas([deltas], dtype=np.float32)[:, 0]
+        nodes = []
+        for node, r in ranges.items():
+            if node not in ct.index:
+                raise ValueError(f"Unknown node '{node}'.")
+            lo, hi = float(r["low"]), float(r["high"])
+            dist = r.get("dist") or "uniform"
+            if dist not in DISTS or hi < lo:
+                raise ValueError(f"Bad range for '{node}': need low <= high and dist in {DISTS}.")
+            mode = r.get("mode")
+            nodes.append((ct.index[node], DISTS.index(dist), lo, hi, (lo + hi) / 2 if mode is None else float(mode)))
+        nodes.sort()
+        cols = list(zip(*nodes)) or [(), (), (), (), ()]
+        self.inputs = np.array(cols[0], dtype=np.int64)
+        self.dist = np.array(cols[1], dtype=np.int64)
+        self.low, self.high, self.mode = (np.array(c, dtype=np.float64) for c in cols[2:])
+
+        edges = []
+        for k, j in enumerate(ct.edge_index.tolist()):
+            e = tree.edges[j]
+            if e.ci95 is None: continue
+            lo, hi = sorted(e.ci95)
+            mu = e.weight if e.weight is not None else (lo + hi) / 2
+            edges.append((k, mu, (hi - lo) / (2 * Z95)))
+        cols = list(zip(*edges)) or [(), (), ()]
+        self.edges = np.array(cols[0], dtype=np.int64)
+        self.mu, self.sd = (np.array(c, dtype=np.float64) for c in cols[1:])
+
+    def sample(self, rng: np.random.Generator, n: int) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+        """``n`` draws: own deltas ``(nodes, n)`` and per-draw weights for the uncertain edges (float32)."""
+        D = np.repeat(self.base[:, None], n, axis=1)
+        for code in np.unique(self.dist).tolist():
+            sel = self.dist == code
+            lo, hi = self.low[sel, None].astype(np.float32), self.high[sel, None].astype(np.float32)
+            shape = (int(sel.sum()), n)
+            if DISTS[code] == "normal":
+                v = rng.standard_normal(shape, dtype=np.float32) * ((hi - lo) / np.float32(2 * Z95)) + (lo + hi) / 2
+            else:
+                u = rng.random(shape, dtype=np.float32)
+                if DISTS[code] == "uniform":
+                    v = lo + u * (hi - lo)
+                else:  # inverse CDF of the triangular distribution
+                    c = np.clip(self.mode[sel, None].astype(np.float32), lo, hi)
+                    span = np.maximum(hi - lo, np.float32(1e-12))
+                    f = (c - lo) / span
+                    v = np.where(u < f, lo + np.sqrt(u * span * (c - lo)), hi - np.sqrt((1 - u) * span * (hi - c)))
+            D[self.inputs[sel]] = v
+        if not len(self.edges):
+            return D, None
+        W = rng.standard_normal((len(self.edges), n), dtype=np.float32)
+        W *= self.sd[:, None].astype(np.float32)
+        W += self.mu[:, None].astype(np.float32)
+        return D, (self.edges, W)
+
+def _run(ct: CompiledTree, spec: Spec, batches: Sequence[Tuple[int, np.random.SeedSequence]],
+         stats: bool, keep: int) -> Dict[str, Any]:
+    """Propagate a run of batches; returns NSM draws and, with ``stats``, per-node moments
+    and the first ``keep`` draws per node."""
+    n = len(ct)
+    ns, kept = [], []
+    total = np.zeros(n, dtype=np.float64)
+    squares = np.zeros(n, dtype=np.float64)
+    for size, seq in batches:
+        D, sampled = spec.sample(np.random.default_rng(seq), size)
+        X = ct.propagate(D, sampled=sampled, inplace=True)
+        ns.append(X[ct.root].copy())
+        if not stats: continue
+        total += X.sum(axis=1, dtype=np.float64)
+        squares += np.einsum("ij,ij->i", X, X, dtype=np.float64)
+        if keep > 0:
+            kept.append(X[:, :keep].copy())
+            keep -= kept[-1].shape[1]
+    return {"ns": np.concatenate(ns) if ns else np.zeros(0, dtype=np.float32), "sum": total, "sumsq": squares,
+            "sample": np.concatenate(kept, axis=1) if kept else np.zeros((n, 0), dtype=np.float32)}
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(SIM_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+def simulate(ct: CompiledTree, spec: Spec, draws: int, seed: Optional[int] = None,
+             quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95), workers: Optional[int] = None,
+             node_stats: bool = True) -> Dict[str, Any]:
+    """Monte Carlo propagation of ``draws`` sampled scenarios, ``SIM_BATCH`` at a time.
+
+    Batches are seeded from one ``SeedSequence``, so a given ``seed`` reproduces the
+    same draws however the work is split. Past ``SIM_POOL_MIN_DRAWS`` draws (or when
+    ``workers`` asks for it) contiguous runs of batches go to a process pool.
+    NSM quantiles use every draw; per-node mean/sd are exact and per-node quantiles
+    come from the first ``NODE_SAMPLE`` draws.
+    """
+    sizes = [min(SIM_BATCH, draws - k) for k in range(0, draws, SIM_BATCH)]
+    batches = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    keep = min(NODE_SAMPLE, draws) if node_stats else 0
+    workers = min(SIM_WORKERS if workers is None and draws >= SIM_POOL_MIN_DRAWS else (workers or 1), len(batches))
+    if workers > 1:
+        per = -(-len(batches) // workers)
+        runs = [batches[k:k + per] for k in range(0, len(batches), per)]
+        parts = list(_pool().map(_run, [ct] * len(runs), [spec] * len(runs), runs, [node_stats] * len(runs),
+                                 [keep] + [0] * (len(runs) - 1)))
+    else:
+        parts = [_run(ct, spec, batches, node_stats, keep)]
+    ns = np.concatenate([p["ns"] for p in parts])
+    q = [float(x) for x in quantiles]
+    out: Dict[str, Any] = {
+        "draws": draws,
+        "north_star": ct.ids[ct.root],
+        "ns": {"mean": float(ns.mean()), "sd": float(ns.std()), "p_positive": float((ns > 0).mean()),
+               "quantiles": dict(zip(map(str, q), np.quantile(ns, q).tolist()))},
+    }
+    if node_stats:
+        mean = sum(p["sum"] for p in parts) / draws
+        sd = np.sqrt(np.maximum(sum(p["sumsq"] for p in parts) / draws - mean ** 2, 0))
+        Q = np.quantile(parts[0]["sample"], q, axis=1)
+        out["nodes"] = {i: {"mean": float(mean[k]), "sd": float(sd[k]), "quantiles": dict(zip(map(str, q), Q[:, k].tolist()))}
+                        for k, i in enumerate(ct.ids)}
+    return out
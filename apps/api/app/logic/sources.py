@@ -0,0 +1,122 @@
+from __future__ import annotations
+import os, json, time, fcntl, threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+SOURCES_PATH = os.path.join(DATA_DIR, "sources.jsonl")
+
+class SourceRegistry:
+    """What was fetched for each ingested URL: validators, content hash and chunk ids.
+
+    Kept as an append-only log (last line per URL wins) so recording a change costs
+    one line, not a rewrite of the registry; the log is compacted on load once it
+    holds more than twice as many lines as URLs. Every process reads the log
+    incrementally from where it left off, and writers (``put``/``forget``/
+    ``compact``) hold an ``flock`` of ``<log>.lock`` and catch up first, so
+    compaction never drops lines another worker appended.
+    """
+
+    def __init__(self, path: str = SOURCES_PATH):
+        self.path = path
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._pos = 0      # bytes of the log already applied
+        self._inode = None  # compaction swaps in a new file
+        self._lock = threading.RLock()
+        self.load()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive across threads and processes; the view is caught up on entry."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Apply lines appended since the last read (everything, if the log was replaced)."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if st.st_ino != self._inode or st.st_size < self._pos:
+                self._data, self._lines, self._pos, self._inode = {}, 0, 0, st.st_ino
+            if st.st_size == self._pos:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._pos)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1  # a torn last line is re-read once complete
+            for line in chunk[:end].splitlines():
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("deleted"):
+                    self._data.pop(rec["url"], None)
+                else:
+                    self._data[rec["url"]] = rec
+                self._lines += 1
+            self._pos += end
+
+    def load(self):
+        self._sync()
+        if self._lines > 2 * len(self._data) + 64:
+            self.compact()
+
+    def compact(self):
+        with self._locked():
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for rec in self._data.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            st = os.stat(self.path)
+            self._lines, self._pos, self._inode = len(self._data), st.st_size, st.st_ino
+
+    def _append(self, rec: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._sync()
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        self._sync()
+        return self._data.get(url)
+
+    def urls(self) -> List[str]:
+        self._sync()
+        return list(self._data)
+
+    def __len__(self) -> int:
+        self._sync()
+        return len(self._data)
+
+    def put(self, url: str, **fields: Any) -> Dict[str, Any]:
+        """Merge ``fields`` into the record for ``url`` and append it to the log."""
+        with self._locked():
+            rec = {**self._data.get(url, {}), **fields, "url": url, "updated": time.time()}
+            self._append(rec)
+        return rec
+
+    def forget(self, url: str) -> bool:
+        with self._locked():
+            if url not in self._data:
+                return False
+            self._append({"url": url, "deleted": True})
+        return True
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """``If-None-Match`` / ``If-Modified-Since`` for a re-fetch of ``url``."""
+        rec = self.get(url) or {}
+        h = {}
+        if rec.get("etag"): h["if-none-match"] = rec["etag"]
+        if rec.get("last_modified"): h["if-modified-since"] = rec["last_modified"]
+        return h
+
+SOURCES = SourceRegistry()
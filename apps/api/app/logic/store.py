@@ -0,0 +1,488 @@
+from __future__ import annotations
+import os, json, fcntl, threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+STORE_DIR = os.path.join(DATA_DIR, "store")
+SEGMENT_ROWS = int(os.environ.get("RAG_SEGMENT_ROWS", "65536"))
+# Compact once this share of sealed rows is dead, or sealed segments are under half full
+COMPACT_DEAD_RATIO = float(os.environ.get("RAG_COMPACT_DEAD_RATIO", "0.2"))
+# fsync each group commit (0 = leave durability to the OS page cache)
+FSYNC = os.environ.get("RAG_STORE_FSYNC", "1") != "0"
+
+CORRUPT = {"id": None, "corrupt": True}  # stands in for an unparseable metadata line
+
+def _parse(line: bytes) -> Dict[str, Any]:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return dict(CORRUPT)
+
+class SegmentStore:
+    """On-disk vector store split into append-only segments.
+
+    Each segment is ``<name>.vec`` (raw, row-major, pre-normalized float32, read
+    through ``np.memmap``) plus ``<name>.meta.jsonl`` (one metadata record per row,
+    no vector). ``manifest.json`` holds the vector dimension and segment order;
+    ingest always appends to the last segment until it holds ``SEGMENT_ROWS`` rows.
+    Deleted rows are never rewritten in place: ``tombstones.jsonl`` records the
+    ``(id, segment, row)`` of each one and readers mask them out. ``compact()``
+    rewrites the sealed segments without dead or corrupt rows into fresh, full
+    segments and bumps the manifest ``epoch`` so readers rebuild their row numbering.
+
+    Writers in every process serialize on an ``flock`` of ``store.lock``. Within a
+    process, concurrent ``append`` calls are group-committed: one thread writes
+    everything queued so far in a single locked pass and one ``fsync`` per file,
+    then wakes the others. Before writing, the active segment's metadata lines and
+    vector rows are re-aligned, truncating the torn tail a crashed writer may have
+    left, so a crash loses at most the group in flight and never shifts rows.
+    """
+
+    def __init__(self, root: str = STORE_DIR, segment_rows: int = SEGMENT_ROWS):
+        self.root = root
+        self.segment_rows = segment_rows
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.tombstones_path = os.path.join(root, "tombstones.jsonl")
+        self.manifest = self._load_manifest()
+        self.generation = 0  # bumped on every in-process append/delete
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(root, "store.lock")
+        self._tail: Dict[str, Tuple[int, int]] = {}  # segment -> (verified meta bytes, lines)
+        self._cv = threading.Condition()
+        self._queue: List[Dict[str, Any]] = []
+        self._leader = False
+        self.commits = 0
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive across threads (``_lock``) and across processes (``flock``)."""
+        with self._lock, open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reload(self):
+        """Re-read the manifest (picks up segments created by other processes)."""
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dim": None, "segments": [], "epoch": 0}
+
+    def _save_manifest(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.manifest.get("dim")
+
+    @property
+    def epoch(self) -> int:
+        return self.manifest.get("epoch", 0)
+
+    def segments(self) -> List[str]:
+        return list(self.manifest["segments"])
+
+    def _vec_path(self, seg: str) -> str:
+        return os.path.join(self.root, seg + ".vec")
+
+    def _meta_path(self, seg: str) -> str:
+        return os.path.join(self.root, seg + ".meta.jsonl")
+
+    def rows(self, seg: str) -> int:
+        if not self.dim:
+            return 0
+        try:
+            return os.path.getsize(self._vec_path(seg)) // (4 * self.dim)
+        except FileNotFoundError:
+            return 0
+
+    def __len__(self) -> int:
+        return sum(self.rows(s) for s in self.segments())
+
+    def vectors(self, seg: str) -> np.ndarray:
+        n = self.rows(seg)
+        if n == 0:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        return np.memmap(self._vec_path(seg), dtype="float32", mode="r", shape=(n, self.dim))
+
+    def meta(self, seg: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        n = self.rows(seg) if limit is None else limit
+        out: List[Dict[str, Any]] = []
+        try:
+            with open(self._meta_path(seg), "r", encoding="utf-8") as f:
+                for line in f:
+                    if len(out) >= n: break
+                    out.append(_parse(line))
+        except FileNotFoundError:
+            pass
+        return out
+
+    def meta_from(self, seg: str, offset: int, n: int,
+                  offsets: Optional[List[int]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Read up to ``n`` metadata rows from byte ``offset``; returns rows and the next offset.
+
+        ``offsets``, if given, receives the byte offset of each row read (for ``meta_at``).
+        """
+        out: List[Dict[str, Any]] = []
+        try:
+            with open(self._meta_path(seg), "rb") as f:
+                f.seek(offset)
+                while len(out) < n:
+                    line = f.readline()
+                    if not line.endswith(b"\n"): break
+                    out.append(_parse(line))
+                    if offsets is not None: offsets.append(offset)
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return out, offset
+
+    def meta_at(self, seg: str, offsets: List[int]) -> List[Optional[Dict[str, Any]]]:
+        """Metadata rows starting at these byte offsets; None for each if the segment is gone."""
+        try:
+            with open(self._meta_path(seg), "rb") as f:
+                out = []
+                for off in offsets:
+                    f.seek(off)
+                    out.append(_parse(f.readline()))
+                return out
+        except FileNotFoundError:  # compacted away since the caller looked it up
+            return [None] * len(offsets)
+
+    def iter_meta(self) -> Iterator[Dict[str, Any]]:
+        for seg in self.segments():
+            yield from self.meta(seg)
+
+    def _new_segment(self) -> str:
+        k = self.manifest.get("next", len(self.manifest["segments"]))
+        self.manifest["next"] = k + 1
+        return f"seg-{k:06d}"
+
+    def _active_segment(self) -> str:
+        segs = self.manifest["segments"]
+        if not segs or self.rows(segs[-1]) >= self.segment_rows:
+            segs.append(self._new_segment())
+            self._save_manifest()
+        return segs[-1]
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """Append records (each with a ``vector``); returns once they are committed."""
+        records = [r for r in records if isinstance(r.get("vector"), (list, np.ndarray)) and len(r["vector"])]
+        if not records:
+            return 0
+        dims = {len(r["vector"]) for r in records}
+        if len(dims) > 1 or (self.dim and self.dim not in dims):
+            raise ValueError(f"vector dimension {sorted(dims)} does not match store dimension {self.dim}")
+        req = {"records": records, "done": False, "written": 0, "error": None}
+        with self._cv:
+            self._queue.append(req)
+            while self._leader and not req["done"]:
+                self._cv.wait()
+            if not req["done"]:
+                self._leader = True
+        if not req["done"]:
+            self._lead()
+        if req["error"] is not None:
+            raise req["error"]
+        return req["written"]
+
+    def _lead(self):
+        """Commit queued appends, group by group, until the queue is empty."""
+        while True:
+            with self._cv:
+                group, self._queue = self._queue, []
+                if not group:
+                    self._leader = False
+                    self._cv.notify_all()
+                    return
+            try:
+                with self._locked():
+                    self.reload()
+                    if not self.dim:
+                        self.manifest["dim"] = len(group[0]["records"][0]["vector"])
+                        self._save_manifest()
+                    ok = [req for req in group if len(req["records"][0]["vector"]) == self.dim]
+                    for req in group:
+                        if req not in ok:
+                            req["error"] = ValueError(f"vector dimension does not match store dimension {self.dim}")
+                    self._append([r for req in ok for r in req["records"]])
+                    for req in ok:
+                        req["written"] = len(req["records"])
+                    self.generation += 1
+                    self.commits += 1
+            except BaseException as e:
+                for req in group:
+                    req["error"] = e
+            with self._cv:
+                for req in group:
+                    req["done"] = True
+                self._cv.notify_all()
+
+    def _align(self, seg: str) -> int:
+        """Make ``seg``'s metadata lines and vector rows agree, dropping a torn tail; returns rows.
+
+        Called with the store locked, so no live writer can be mid-append. Only bytes
+        appended since the last check are scanned.
+        """
+        mp, vp, rowbytes = self._meta_path(seg), self._vec_path(seg), 4 * self.dim
+        size, lines = self._tail.get(seg, (0, 0))
+        cur = os.path.getsize(mp) if os.path.exists(mp) else 0
+        if cur < size:  # rewritten underneath us
+            size, lines = 0, 0
+        if cur > size:
+            with open(mp, "rb") as f:
+                f.seek(size)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # complete lines only
+            lines += data.count(b"\n", 0, end)
+            size += end
+        vsize = os.path.getsize(vp) if os.path.exists(vp) else 0
+        n = min(lines, vsize // rowbytes)
+        if vsize != n * rowbytes:
+            os.truncate(vp, n * rowbytes)
+        if lines > n:  # metadata whose vectors never landed
+            with open(mp, "rb") as f:
+                size = sum(len(line) for _, line in zip(range(n), f))
+            lines = n
+        if cur != size:
+            os.truncate(mp, size)
+        self._tail[seg] = (size, lines)
+        return n
+
+    def _append(self, records: List[Dict[str, Any]]) -> int:
+        written, i, touched = 0, 0, []
+        while i < len(records):
+            seg = self._active_segment()
+            have = self._align(seg)
+            if have >= self.segment_rows:
+                continue  # _active_segment rolls over on the next pass
+            batch = records[i:i + self.segment_rows - have]
+            M = np.asarray([r["vector"] for r in batch], dtype="float32").reshape(len(batch), self.dim)
+            M /= (np.linalg.norm(M, axis=1, keepdims=True) + 1e-8)
+            meta = "".join(json.dumps({k: v for k, v in r.items() if k != "vector"}, ensure_ascii=False) + "\n"
+                           for r in batch).encode("utf-8")
+            # metadata first: a row is only visible once its vector bytes land
+            with open(self._meta_path(seg), "ab") as f:
+                f.write(meta)
+            with open(self._vec_path(seg), "ab") as f:
+                f.write(M.tobytes())
+            touched.append(seg)
+            size, lines = self._tail[seg]
+            self._tail[seg] = (size + len(meta), lines + len(batch))
+            written += len(batch)
+            i += len(batch)
+        if FSYNC:  # one fsync per file for the whole group
+            for seg in dict.fromkeys(touched):
+                self._fsync(self._meta_path(seg))
+                self._fsync(self._vec_path(seg))
+        return written
+
+    @staticmethod
+    def _fsync(path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def delete(self, rows: List[Tuple[str, str, int]], epoch: Optional[int] = None) -> int:
+        """Tombstone rows given as ``(id, segment, segment row)``; returns the number recorded.
+
+        Locations are only valid for the ``epoch`` they were read in: if a compaction
+        has happened since, nothing is recorded and -1 is returned.
+        """
+        if not rows:
+            return 0
+        with self._locked():
+            self.reload()
+            if epoch is not None and epoch != self.epoch:
+                return -1
+            with open(self.tombstones_path, "a", encoding="utf-8") as f:
+                for rid, seg, row in rows:
+                    f.write(json.dumps({"id": rid, "seg": seg, "row": int(row)}) + "\n")
+            self.generation += 1
+        return len(rows)
+
+    def tombstones_from(self, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Tombstones recorded past byte ``offset``; returns them and the next offset."""
+        out: List[Dict[str, Any]] = []
+        try:
+            with open(self.tombstones_path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"): break
+                    out.append(json.loads(line))
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return out, offset
+
+    def _dead(self, tombstones: List[Dict[str, Any]]) -> Dict[str, set]:
+        dead: Dict[str, set] = {}
+        for t in tombstones:
+            dead.setdefault(t["seg"], set()).add(t["row"])
+        return dead
+
+    def stats(self) -> Dict[str, Any]:
+        dead = self._dead(self.tombstones_from(0)[0])
+        segs = [{"segment": seg, "rows": self.rows(seg), "dead": len(dead.get(seg, ()))} for seg in self.segments()]
+        return {"dim": self.dim, "epoch": self.epoch, "rows": sum(x["rows"] for x in segs),
+                "dead": sum(x["dead"] for x in segs), "segments": segs}
+
+    def needs_compaction(self) -> bool:
+        sealed = self.stats()["segments"][:-1]
+        rows = sum(x["rows"] for x in sealed)
+        small = sum(x["rows"] - x["dead"] < self.segment_rows // 2 for x in sealed)
+        return bool(rows) and (sum(x["dead"] for x in sealed) >= COMPACT_DEAD_RATIO * rows or small > 1)
+
+    def compact(self) -> Dict[str, Any]:
+        """Rewrite sealed segments from the first one with dead/corrupt rows or spare room.
+
+        The last segment is still being appended to and is left alone. Live rows are
+        copied (vector bytes and metadata lines verbatim) into new full segments,
+        then the manifest and tombstone log are swapped under the store lock;
+        tombstones recorded meanwhile are re-pointed at the rows' new locations.
+        Only one compaction runs at a time across processes.
+        """
+        with open(os.path.join(self.root, "compact.lock"), "a") as guard:
+            try:
+                fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return {"ok": False, "busy": True, "compacted": 0}
+            return self._compact()
+
+    def _compact(self) -> Dict[str, Any]:
+        with self._locked():
+            self.reload()
+            segs = self.segments()[:-1]
+            tombs, tomb_offset = self.tombstones_from(0)
+        dead = self._dead(tombs)
+        first = next((k for k, seg in enumerate(segs)
+                      if dead.get(seg) or self.rows(seg) < self.segment_rows), len(segs))
+        old = segs[first:]
+        if not old:
+            return {"ok": True, "compacted": 0}
+        new: List[str] = []
+        remap: Dict[str, np.ndarray] = {}  # old segment -> new position per row (-1 = dropped)
+        pos = 0
+        out_meta = out_vec = None
+        for seg in old:
+            V = self.vectors(seg)
+            keep = np.full(len(V), -1, dtype=np.int64)
+            with open(self._meta_path(seg), "rb") as f:
+                for row, line in enumerate(f):
+                    if row >= len(V): break  # metadata without vector bytes: crashed append
+                    if row in dead.get(seg, ()) or not line.endswith(b"\n") or _parse(line).get("corrupt"):
+                        continue
+                    if pos % self.segment_rows == 0:
+                        if out_meta: out_meta.close(); out_vec.close()
+                        with self._locked():
+                            self.reload()
+                            new.append(self._new_segment())
+                            self._save_manifest()
+                        out_meta = open(self._meta_path(new[-1]), "wb")
+                        out_vec = open(self._vec_path(new[-1]), "wb")
+                    out_meta.write(line)
+                    out_vec.write(np.ascontiguousarray(V[row]).tobytes())
+                    keep[row] = pos
+                    pos += 1
+            remap[seg] = keep
+        if out_meta: out_meta.close(); out_vec.close()
+        if FSYNC:
+            for seg in new:
+                for path in (self._meta_path(seg), self._vec_path(seg)):
+                    self._fsync(path)
+        with self._locked():
+            self.reload()
+            late, _ = self.tombstones_from(tomb_offset)
+            tombs_out = []
+            for k, t in enumerate(tombs + late):
+                if t["seg"] not in remap:
+                    tombs_out.append(t)
+                    continue
+                keep = remap[t["seg"]]
+                p = int(keep[t["row"]]) if t["row"] < len(keep) else -1
+                if p >= 0 and k >= len(tombs):  # deleted while we copied it
+                    tombs_out.append({**t, "seg": new[p // self.segment_rows], "row": p % self.segment_rows})
+            tmp = self.tombstones_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for t in tombs_out:
+                    f.write(json.dumps(t) + "\n")
+            cur = self.manifest["segments"]
+            k = cur.index(old[0])
+            self.manifest["segments"] = cur[:k] + new + cur[k + len(old):]
+            self.manifest["epoch"] = self.epoch + 1
+            os.replace(tmp, self.tombstones_path)
+            self._save_manifest()
+            self.generation += 1
+        for seg in old:
+            for path in (self._vec_path(seg), self._meta_path(seg)):
+                if os.path.exists(path): os.remove(path)
+        return {"ok": True, "compacted": len(old), "segments": len(new), "rows": pos,
+                "dropped": sum(len(r) for r in remap.values()) - pos}
+
+def migrate_jsonl(path: str, store: SegmentStore, batch: int = 4096) -> int:
+    """One-shot import of a legacy ``rag_store.jsonl``; renames it to ``*.migrated``.
+
+    Runs under an ``flock`` of ``migrate.lock`` in the store, and the file is checked
+    again once the lock is held, so workers starting together import it only once.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(os.path.join(store.root, "migrate.lock"), "a") as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(path):  # another process migrated it while we waited
+                return 0
+            n, buf = 0, []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        j = json.loads(line)
+                    except Exception:
+                        continue
+                    if isinstance(j.get("vector"), list):
+                        buf.append(j)
+                    if len(buf) >= batch:
+                        n += store.append(buf); buf = []
+            n += store.append(buf)
+            os.replace(path, path + ".migrated")
+            return n
+        finally:
+            fcntl.flock(guard, fcntl.LOCK_UN)
+
+STORE = SegmentStore()
+
+if __name__ == "__main__":
+    import sys, time, tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    if sys.argv[1:2] == ["bench"]:
+        # concurrent-ingest throughput: python -m app.logic.store bench [threads] [appends per thread] [rows per append]
+        threads, per, rows = (int(x) for x in (sys.argv[2:] + ["8", "50", "64"][len(sys.argv) - 2:])[:3])
+        store = SegmentStore(tempfile.mkdtemp())
+        V = np.random.default_rng(0).standard_normal((rows, 384)).astype("float32")
+        def ingest(t):
+            for k in range(per):
+                store.append([{"id": f"{t}-{k}-{i}", "text": "x" * 900, "vector": v} for i, v in enumerate(V)])
+        t = time.perf_counter()
+        with ThreadPoolExecutor(threads) as ex:
+            list(ex.map(ingest, range(threads)))
+        dt = time.perf_counter() - t
+        n = threads * per * rows
+        print(json.dumps({"threads": threads, "rows": len(store), "expected": n, "commits": store.commits,
+                          "secs": round(dt, 2), "rows_per_sec": round(n / dt), "fsync": FSYNC}))
+    else:
+        legacy = os.path.join(DATA_DIR, "rag_store.jsonl")
+        print(f"migrated {migrate_jsonl(legacy, STORE)} records into {STORE.root}")
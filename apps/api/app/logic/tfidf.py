@@ -0,0 +1,217 @@
+from __future__ import annotations
+import os, json, time, uuid, threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from .ann import topk
+
+# Hashed vocabulary size: no fitted vocabulary, so documents can be added at any time
+FEATURES = int(os.environ.get("RAG_TFIDF_FEATURES", str(1 << 20)))
+# Recompute document norms once the corpus has grown by this factor (idf drifts with it)
+RENORM_GROWTH = float(os.environ.get("RAG_TFIDF_RENORM_GROWTH", "1.25"))
+
+class TfidfIndex:
+    """Incrementally updatable TF-IDF (raw tf, smooth idf, L2-normalized cosine).
+
+    Terms are hashed (``HashingVectorizer``), so adding documents only bumps the
+    document-frequency counts; idf is derived from them at query time. Rows live in
+    a term-major CSR base (memory-mapped from disk after ``load``/``save``) plus an
+    in-memory delta of rows added since, so a query reads only its terms' postings.
+    Document norms are kept per row and recomputed in one vectorized pass whenever
+    the corpus has grown by ``RENORM_GROWTH`` since they were last computed.
+    """
+
+    def __init__(self, n_features: int = FEATURES):
+        self.n_features = n_features
+        self._hv = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None,
+                                     stop_words="english", dtype=np.float32)
+        self.rows = 0  # rows [0, rows) are indexed
+        self.df = np.zeros(n_features, dtype=np.int32)
+        self._base = 0  # rows [0, _base) are in the CSR base
+        self._indptr = np.zeros(n_features + 1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.int32)
+        self._tf = np.zeros(0, dtype=np.float32)
+        self._delta: List[sp.csr_matrix] = []  # doc-major rows [_base, rows)
+        self._delta_csc: Optional[sp.csc_matrix] = None
+        self._norm = np.zeros(0, dtype=np.float32)
+        self._norm_n = 0  # corpus size the norms were computed at
+        self._files: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _idf(self, df: np.ndarray, n: int) -> np.ndarray:
+        return (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    def add(self, records: List[Dict[str, Any]], start: int):
+        """Index ``records`` as rows ``start...``; rows already covered (e.g. by a snapshot) are skipped."""
+        with self._lock:
+            skip = max(0, self.rows - start)
+            if skip >= len(records):
+                return
+            X = self._hv.transform([r.get("text") or "" for r in records[skip:]])
+            X.sum_duplicates()
+            self.df += np.bincount(X.indices, minlength=self.n_features).astype(np.int32)
+            self._delta.append(X)
+            self._delta_csc = None
+            end = self.rows + X.shape[0]
+            if end > len(self._norm):
+                grown = np.zeros(max(end, 2 * len(self._norm), 1024), dtype=np.float32)
+                grown[:self.rows] = self._norm[:self.rows]
+                self._norm = grown
+            self.rows = end
+            if self.rows >= RENORM_GROWTH * self._norm_n:
+                self._renorm()
+            else:
+                self._norm[end - X.shape[0]:end] = self._row_norms(X, self._idf(self.df[X.indices], self.rows))
+
+    def _row_norms(self, X: sp.csr_matrix, idf: np.ndarray) -> np.ndarray:
+        """L2 norms of the rows of ``X`` given the idf of each stored entry."""
+        w = (X.data * idf) ** 2
+        owner = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+        return np.sqrt(np.bincount(owner, weights=w, minlength=X.shape[0])).astype(np.float32)
+
+    def _renorm(self):
+        idf = self._idf(self.df, self.rows)
+        terms = np.repeat(np.arange(self.n_features), np.diff(self._indptr))
+        sq = np.bincount(self._docs, weights=(self._tf * idf[terms]) ** 2, minlength=self._base)
+        self._norm[:self._base] = np.sqrt(sq)
+        if self._delta:
+            D = self._merged_delta()
+            self._norm[self._base:self.rows] = self._row_norms(D, idf[D.indices])
+        self._norm_n = self.rows
+
+    def _merged_delta(self) -> sp.csr_matrix:
+        if len(self._delta) > 1:
+            self._delta = [sp.vstack(self._delta, format="csr")]
+        return self._delta[0]
+
+    def _postings(self, f: int, base: Tuple[np.ndarray, np.ndarray, np.ndarray, int],
+                  delta: Optional[sp.csc_matrix]) -> Tuple[np.ndarray, np.ndarray]:
+        indptr, docs, tf, start = base
+        rows, tfs = docs[indptr[f]:indptr[f + 1]], tf[indptr[f]:indptr[f + 1]]
+        if delta is not None and delta.indptr[f + 1] > delta.indptr[f]:
+            a, b = delta.indptr[f], delta.indptr[f + 1]
+            rows = np.concatenate([rows, delta.indices[a:b] + start])
+            tfs = np.concatenate([tfs, delta.data[a:b]])
+        return rows, tfs
+
+    def scores(self, query: str, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows sharing a term with ``query`` and their cosine similarity; ``mask`` (bool per row) restricts them."""
+        qv = self._hv.transform([query])
+        qv.sum_duplicates()
+        with self._lock:
+            n = self.rows if mask is None else min(self.rows, len(mask))
+            if not n or not qv.nnz:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            if self._delta and self._delta_csc is None:
+                self._delta_csc = self._merged_delta().tocsc()
+            base = (self._indptr, self._docs, self._tf, self._base)
+            delta, norm = self._delta_csc if self._delta else None, self._norm
+            df, total = self.df[qv.indices], self.rows
+        seen = df > 0  # unseen terms match nothing; leaving them out keeps scores true cosines
+        if not seen.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        feats, idf = qv.indices[seen], self._idf(df[seen], total)
+        qw = qv.data[seen] * idf
+        qw /= np.linalg.norm(qw)
+        ids, contrib = [], []
+        for f, w, i in zip(feats.tolist(), qw, idf):
+            rows, tf = self._postings(f, base, delta)
+            keep = rows < n
+            if mask is not None:
+                keep[keep] = mask[rows[keep]]
+            rows, tf = rows[keep], tf[keep]
+            if not len(rows): continue
+            ids.append(rows)
+            contrib.append(w * i * tf / np.maximum(norm[rows], 1e-12))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, contrib = np.concatenate(ids).astype(np.int64), np.concatenate(contrib)
+        if len(ids) > n // 8:
+            acc = np.bincount(ids, weights=contrib, minlength=n)
+            rows = np.flatnonzero(acc)
+            return rows, acc[rows].astype(np.float32)
+        rows, inv = np.unique(ids, return_inverse=True)
+        return rows, np.bincount(inv, weights=contrib).astype(np.float32)
+
+    def search(self, query: str, limit: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        rows, s = self.scores(query, mask)
+        top = topk(s, limit)
+        return rows[top], s[top]
+
+    def save(self, root: str, key: Any, upto: int):
+        """Merge base and delta rows ``[0, upto)`` into a new CSR base under ``root``.
+
+        Arrays go to fresh ``.npy`` files and ``tfidf.json`` is swapped in last, so a
+        reader sees either the old snapshot or the new one. Afterwards this index
+        serves the merged base from the memory-mapped files.
+        """
+        with self._lock:
+            base, start, upto = (self._indptr, self._docs, self._tf), self._base, min(upto, self.rows)
+            if upto <= start:
+                return
+            D = self._merged_delta()[:upto - start].tocsc()
+            norm, norm_n = self._norm[:upto].copy(), self._norm_n
+        indptr, docs, tf = _merge(base, D, start)
+        os.makedirs(root, exist_ok=True)
+        tag = f"{time.time_ns():x}-{os.getpid()}-{uuid.uuid4().hex[:8]}"  # unique per saver (workers, threads)
+        files = {}
+        for name, arr in (("indptr", indptr), ("docs", docs), ("tf", tf), ("norm", norm)):
+            files[name] = f"{name}.{tag}.npy"
+            np.save(os.path.join(root, files[name]), arr)
+        manifest = {"key": key, "rows": upto, "features": self.n_features, "norm_n": min(norm_n, upto), "files": files}
+        tmp = os.path.join(root, f"tfidf.json.{tag}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(root, "tfidf.json"))
+        mapped = _open(root, files)
+        with self._lock:
+            if self._base == start:  # no newer snapshot swapped in meanwhile
+                rest = self._merged_delta()[upto - start:]
+                self._indptr, self._docs, self._tf = mapped[:3]
+                self._base, self._delta, self._delta_csc = upto, [rest] if rest.shape[0] else [], None
+            old, self._files = self._files, list(files.values())
+        for name in old:  # mapped files stay readable to anyone holding them
+            try: os.remove(os.path.join(root, name))
+            except OSError: pass
+
+    def load(self, root: str, accept: Callable[[Any], bool]) -> bool:
+        """Map a snapshot from ``root`` if ``accept(key)`` says its layout still matches the store."""
+        try:
+            with open(os.path.join(root, "tfidf.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["features"] != self.n_features or not accept(manifest["key"]):
+                return False
+            indptr, docs, tf, norm = _open(root, manifest["files"])
+        except Exception:  # missing or unreadable: rebuilt from the store
+            return False
+        n = int(manifest["rows"])
+        with self._lock:
+            self._indptr, self._docs, self._tf, self._base = indptr, docs, tf, n
+            self.df = np.diff(indptr).astype(np.int32)
+            self._norm = np.array(norm, dtype=np.float32)
+            self.rows, self._norm_n, self._delta, self._delta_csc = n, manifest["norm_n"], [], None
+            self._files = list(manifest["files"].values())
+        return True
+
+def _open(root: str, files: Dict[str, str]) -> Tuple[np.ndarray, ...]:
+    return tuple(np.load(os.path.join(root, files[k]), mmap_mode="r") for k in ("indptr", "docs", "tf", "norm"))
+
+def _merge(base: Tuple[np.ndarray, np.ndarray, np.ndarray], D: sp.csc_matrix, start: int) -> Tuple[np.ndarray, ...]:
+    """Term-major CSR of the base rows followed, per term, by the delta rows (offset by ``start``)."""
+    bi, bdocs, btf = base
+    bc, dc = np.diff(bi), np.diff(D.indptr)
+    indptr = np.zeros(len(bi), dtype=np.int64)
+    np.cumsum(bc + dc, out=indptr[1:])
+    docs = np.empty(indptr[-1], dtype=np.int32)
+    tf = np.empty(indptr[-1], dtype=np.float32)
+    terms = np.repeat(np.arange(len(bc)), bc)
+    at = indptr[:-1][terms] + np.arange(len(terms)) - bi[:-1][terms]
+    docs[at], tf[at] = bdocs, btf
+    terms = np.repeat(np.arange(len(dc)), dc)
+    at = indptr[:-1][terms] + bc[terms] + np.arange(len(terms)) - D.indptr[:-1][terms]
+    docs[at], tf[at] = D.indices + start, D.data
+    return indptr, docs, tf
@@ -1,4 +1,7 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse
 # from .some_router import router as lint_router
 from fastapi.middleware.cors import CORSMiddleware
 from .models.schema import NSMRequest, NSMCandidate, ExpandRequest, Tree
@@ -6,8 +9,22 @@ from .logic.nsm import suggest_nsm
 from .logic.tree import expand_tree
 from .logic.explain import explain_node
 from .logic.rag import rag_search
+from .logic.postings import FIELDS as FILTER_FIELDS
+from .logic.embedder import EMBEDDER
+from .logic.jobs import JOBS
+from .logic.store import STORE
+from .logic.qdrant import QDRANT
 
-app = FastAPI(title="Metric Trees API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the embedding model off the request path; /healthz is live meanwhile
+    if os.environ.get("RAG_EMBED_WARMUP", "1") != "0":
+        EMBEDDER.warmup()
+    JOBS.start()  # resumes jobs left queued/running by a previous run
+    QDRANT.bootstrap(lambda: STORE.dim or EMBEDDER.dim)  # collection check once, not per request
+    yield
+
+app = FastAPI(title="Metric Trees API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +41,12 @@ app.add_middleware(
 def health():
     return {"ok": True}
 
+@app.get("/readyz")
+def ready():
+    status = EMBEDDER.status()
+    ok = status["ready"] or not status["available"]  # no fastembed: keyword search only, nothing to wait for
+    return JSONResponse({"ok": ok, "embedder": status}, status_code=200 if ok else 503)
+
 @app.post("/metric-tree/suggest")
 def suggest(req: NSMRequest) -> dict[str, list[NSMCandidate]]:
     ideas = suggest_nsm(req.industry, req.product_type, req.emphasis)
@@ -59,11 +82,13 @@ def lint(payload: dict = Body(...)) -> dict:
             warnings.append(f"Unlinked node '{n.name}'.")
     return {"warnings": warnings}
 
-@app.post("/rag/search")
+@app.post("/rag/simple-search")
 def rag(payload: dict = Body(...)) -> dict:
+    # TF-IDF over the seed templates + corpus; /rag/search (rag_router) is the full search
     q = payload.get("q","")
     k = int(payload.get("k",3))
-    return {"results": rag_search(q,k)}
+    filters = {f: payload[f] for f in FILTER_FIELDS if payload.get(f)}
+    return {"results": rag_search(q, k, **filters)}
 
 # --- RAG router ---
 from .rag_router import router as rag_router
@@ -83,3 +108,7 @@ app.include_router(elasticities_router)
 
 from .ideate_router import router as ideate_router
 app.include_router(ideate_router)
+
+# --- Scenario router ---
+from .scenario_router import router as scenario_router
+app.include_router(scenario_router)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from typing import List, Literal, Optional
+from typing import List, Literal, Optional, Tuple
 
 Relation = Literal["sum", "product", "ratio", "influences"]
 
@@ -20,6 +20,8 @@ class Edge(BaseModel):
     src: str
     dst: str
     relation: Relation = "influences"
+    weight: Optional[float] = None  # share/elasticity (sum, influences) or exponent (product, ratio)
+    ci95: Optional[Tuple[float, float]] = None  # weight uncertainty, e.g. from /elasticities/estimate
 
 class Tree(BaseModel):
     north_star: Node
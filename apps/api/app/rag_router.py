@@ -1,96 +1,85 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import os, io, json, uuid, re
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple
+import os, io, re, time, asyncio, hashlib, shutil, tempfile
 import requests
 from bs4 import BeautifulSoup
-from pypdf import PdfReader
-import numpy as np
-
-# Embeddings (always via fastembed)
-try:
-    from fastembed import TextEmbedding
-except Exception:
-    TextEmbedding = None
-
-# Qdrant (optional)
-try:
-    from qdrant_client import QdrantClient
-    from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue
-except Exception:
-    QdrantClient = None
-    Distance = VectorParams = Filter = FieldCondition = MatchValue = None  # type: ignore
+from .logic.store import STORE, migrate_jsonl
+from .logic.index import INDEX
+from .logic.ann import IVFIndex, recall_report, sample_queries
+from .logic.postings import FIELDS as FILTER_FIELDS
+from .logic.embed_cache import QUERY_CACHE
+from .logic.embedder import EMBEDDER
+from .logic.ingest import run_ingest, iter_text, iter_pdf_pages, chunk_hash, chunk_id, READ_BLOCK
+from .logic.crawl import ingest_urls
+from .logic.jobs import JOBS
+from .logic.sources import SOURCES
+from .logic.qdrant import QDRANT, match_filter
+from .logic.bm25 import rrf
 
 router = APIRouter(prefix="/rag", tags=["rag"])
 
-QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
-QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
-COLLECTION = os.environ.get("QDRANT_COLLECTION", "rag_chunks")
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
 os.makedirs(DATA_DIR, exist_ok=True)
-JSONL_PATH = os.path.join(DATA_DIR, "rag_store.jsonl")
+JSONL_PATH = os.path.join(DATA_DIR, "rag_store.jsonl")  # legacy format, migrated into STORE once
+migrate_jsonl(JSONL_PATH, STORE)
 
-_embedder = TextEmbedding() if TextEmbedding else None
-EMBED_DIM = 384  # bge-small
-
-def _client():
-    if QdrantClient is None:
-        return None
-    try:
-        return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=5.0)
-    except Exception:
-        return None
-
-def _ensure_collection():
-    client = _client()
-    if not client or Distance is None or VectorParams is None:
-        return
-    try:
-        names = [c.name for c in client.get_collections().collections]
-        if COLLECTION not in names:
-            client.create_collection(COLLECTION, vectors_config=VectorParams(size=EMBED_DIM, distance=Distance.COSINE))
-    except Exception:
-        pass
+SPOOL_BYTES = 8 << 20  # fetched bodies past this spill to a temp file
 
 def _clean(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "")).strip()
 
-def _chunk(text: str, max_len=900, overlap=200):
-    text = _clean(text)
-    if not text: return []
-    if len(text) <= max_len: return [text]
-    out, i = [], 0
-    while i < len(text):
-        out.append(text[i:i+max_len])
-        i += max_len - overlap
-    return out
-
 def _embed(texts: List[str]) -> List[List[float]]:
-    if not _embedder: return []
-    return list(_embedder.embed(texts))
-
-def _append_jsonl(records: List[Dict[str, Any]]):
-    with open(JSONL_PATH, "a", encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-
-def _upsert_qdrant(records: List[Dict[str, Any]]):
-    client = _client()
-    if not client: return
-    _ensure_collection()
+    return EMBEDDER.embed(texts)
+
+def _embed_queries(qs: List[str]) -> List[List[float]]:
+    return EMBEDDER.embed_queries(qs)
+
+def _append_store(records: List[Dict[str, Any]]):
+    STORE.append(records)
+
+def _delete_qdrant(ids: List[str]):
+    if not ids or not QDRANT.available: return
     try:
-        client.upsert(
-            collection_name=COLLECTION,
-            points=[{"id": r["id"], "vector": r["vector"], "payload": {k:v for k,v in r.items() if k!='vector'}} for r in records]
-        )
+        QDRANT.delete(ids)
     except Exception:
         pass
 
+def _delete_chunks(ids: List[str]) -> int:
+    n = INDEX.delete(ids)
+    _delete_qdrant(ids)
+    return n
+
 class IngestURL(BaseModel):
     url: str
     industry: Optional[str] = None
     stage: Optional[str] = None
     tags: Optional[List[str]] = None
+    background: bool = False         # enqueue as a job and return its id immediately
+
+class IngestURLs(BaseModel):
+    urls: List[str] = []
+    sitemap: Optional[str] = None    # sitemap.xml (or index) to expand into page URLs
+    industry: Optional[str] = None
+    stage: Optional[str] = None
+    tags: Optional[List[str]] = None
+    concurrency: int = 16
+    per_host: int = 4
+    timeout: float = 20.0
+    max_urls: int = 5000
+
+class DeleteBody(BaseModel):
+    ids: List[str] = []
+    url: Optional[str] = None        # every chunk of this source (and its registry entry)
+    filename: Optional[str] = None
+
+class RefreshSources(BaseModel):
+    urls: List[str] = []             # default: every URL in the source registry
+    concurrency: int = 16
+    per_host: int = 4
+    timeout: float = 20.0
+    background: bool = False
 
 class SearchBody(BaseModel):
     q: str
@@ -98,43 +87,245 @@ class SearchBody(BaseModel):
     provider: Optional[str] = None   # "qdrant" or None
     industry: Optional[str] = None
     stage: Optional[str] = None
+    tags: Optional[List[str]] = None  # all listed tags must match
+    source: Optional[str] = None      # "url" or "file"
+    url: Optional[str] = None
+    filename: Optional[str] = None
+    nprobe: Optional[int] = None     # IVF lists to probe (local-vectors); 0 = exact
+    mode: Optional[str] = None       # "keyword" = BM25 only, "hybrid" = vector + BM25 fused by RRF
+
+    def pool(self) -> int:
+        """Vector candidates to fetch: hybrid fusion needs a deeper list than ``limit``."""
+        return max(4 * self.limit, 50) if (self.mode or "").lower() == "hybrid" else self.limit
+
+    def filters(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in FILTER_FIELDS if getattr(self, k)}
+
+class SearchBatchBody(BaseModel):
+    queries: List[SearchBody]
+    provider: Optional[str] = None   # overrides per-query provider when set
+
+def _guarded(pieces: Iterable[Any]) -> Iterator[Any]:
+    try:
+        yield from pieces
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Parse failed: {e}")
+
+_STORED = object()  # ``_ingest``: chunk already stored under its id, nothing to write
+
+def _ingest(pieces: Iterable[Any], meta: Dict[str, Any], progress=None, ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Stream pieces through chunk → embed → store/Qdrant, one micro-batch at a time.
+
+    Chunks are content-addressed: a chunk whose (text, model) hash is already stored
+    reuses that vector instead of being embedded, and a chunk whose id (hash + source)
+    already exists is not written again, so re-ingesting an unchanged source is ~free.
+    ``ids`` collects the id of every chunk that is now stored, written or not. Chunks
+    the embedder gave no vector for are neither written nor collected; they are
+    counted under ``unembedded`` and make ``ok`` false.
+    New chunks stream into Qdrant in batches (``UpsertWriter``); the per-batch
+    outcome is returned under ``qdrant``.
+    """
+    model = EMBEDDER.model_name
+    origin = meta.get("url") or meta.get("filename") or ""
+    stats = {"duplicates": 0, "reused": 0, "unembedded": 0}
+    seen: set = set()
+    qdrant = QDRANT.writer() if QDRANT.available else None
+
+    def embed(texts: List[str]) -> List[Any]:
+        INDEX.refresh()
+        hashes = [chunk_hash(t, model) for t in texts]
+        ids = [chunk_id(h, origin) for h in hashes]
+        fresh = [n for n, i in enumerate(ids) if i not in INDEX.by_id]
+        known = INDEX.vectors_for_hashes([hashes[n] for n in fresh])
+        stats["reused"] += sum(hashes[n] in known for n in fresh)
+        todo = {hashes[n]: n for n in fresh if hashes[n] not in known}
+        if todo and EMBEDDER.available:  # a short or empty result leaves the rest without a vector
+            known.update(zip(todo, _embed([texts[n] for n in todo.values()])))
+        return [(i, h, _STORED if i in INDEX.by_id else known.get(h)) for i, h in zip(ids, hashes)]
+
+    def write(texts: List[str], vecs: List[Any]) -> int:
+        records = []
+        for ch, (i, h, v) in zip(texts, vecs):
+            if v is None:
+                stats["unembedded"] += 1
+                continue
+            if i in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(i)
+            if ids is not None:
+                ids.append(i)
+            if v is _STORED:
+                stats["duplicates"] += 1
+                continue
+            pages = getattr(ch, "pages", None)
+            records.append({"id": i, "hash": h, "text": str(ch), "vector": v, **meta,
+                            **({"page": pages[0], "page_end": pages[1]} if pages else {})})
+        if records:
+            _append_store(records)
+            if qdrant: qdrant.add(records)
+        return len(records)
+
+    try:
+        chunks, written = run_ingest(_guarded(pieces), embed, write, **({"progress": progress} if progress else {}))
+    finally:
+        upserts = qdrant.close() if qdrant else None
+    if not chunks: raise HTTPException(status_code=400, detail="No text extracted.")
+    return {"ok": not stats["unembedded"], "chunks": written, **stats,
+            **({"error": f"No vector for {stats['unembedded']} chunks (embedder unavailable?)"} if stats["unembedded"] else {}),
+            **({"qdrant": upserts} if upserts and upserts["batches"] else {})}
 
 @router.post("/ingest-url")
 def ingest_url(body: IngestURL):
+    if body.background:
+        job = JOBS.submit("ingest-url", body.model_dump(exclude={"background"}))
+        return {"ok": True, "job_id": job["id"], "status": job["status"]}
+    return _ingest_url(body.model_dump(exclude={"background"}))
+
+def _ingest_url(params: Dict[str, Any], upload: Optional[str] = None, progress=None) -> Dict[str, Any]:
+    body = IngestURL(**params)
     try:
-        r = requests.get(body.url, timeout=20)
+        r = requests.get(body.url, timeout=20, stream=True)
         r.raise_for_status()
+        buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        digest = hashlib.sha256()
+        for block in r.iter_content(READ_BLOCK):
+            buf.write(block)
+            digest.update(block)
+        buf.seek(0)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Fetch failed: {e}")
 
-    text = ""
-    if "pdf" in (r.headers.get("content-type","").lower()) or body.url.lower().endswith(".pdf"):
-        with io.BytesIO(r.content) as bio:
-            reader = PdfReader(bio)
-            for p in reader.pages:
-                text += p.extract_text() or ""
-    else:
-        soup = BeautifulSoup(r.text, "html.parser")
-        text = soup.get_text(separator=" ")
-
-    chunks = _chunk(text)
-    if not chunks: raise HTTPException(status_code=400, detail="No text extracted.")
+    with buf:
+        return _ingest_source(body.url, buf, r.headers, digest.hexdigest(), _url_meta(body), progress, r.encoding)
+
+def _ingest_source(url: str, buf, headers, digest: str, meta: Dict[str, Any], progress=None,
+                   encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Ingest a fetched page and record it in ``SOURCES``.
+
+    An unchanged body (same content hash) is not re-chunked; otherwise chunks the
+    previous version had but this one lacks are tombstoned locally and in Qdrant.
+    Old chunks are only deleted, and the new hash only recorded, once every chunk of
+    the new version is stored; otherwise (model down, empty parse) the old version
+    stays and the next refresh retries.
+    """
+    prev = SOURCES.get(url) or {}
+    validators = {"etag": headers.get("etag"), "last_modified": headers.get("last-modified")}
+    if prev.get("hash") == digest:
+        if any(prev.get(k) != v for k, v in validators.items()):
+            SOURCES.put(url, **validators)
+        return {"ok": True, "chunks": 0, "changed": False}
+    ids: List[str] = []
+    failed: List[Tuple[int, str]] = []
+    out = _ingest(_url_pieces(url, buf, headers.get("content-type", ""), encoding, failed), meta, progress, ids=ids)
+    out.update(_failed_pages(failed))
+    if not ids or out["unembedded"]:
+        return {**out, "changed": True, "replaced": 0}
+    replaced = _delete_chunks(sorted(set(prev.get("chunk_ids", [])) - set(ids)))
+    SOURCES.put(url, hash=digest, chunk_ids=ids, meta=meta, fetched=time.time(), **validators)
+    return {**out, "changed": True, "replaced": replaced}
 
-    vecs = _embed(chunks)
-    records = [{
-        "id": str(uuid.uuid4()),
-        "text": ch,
-        "vector": v,
+def _url_pieces(url: str, buf, content_type: str, encoding: Optional[str] = None,
+                failed: Optional[List[Tuple[int, str]]] = None) -> Iterable[Any]:
+    if "pdf" in content_type.lower() or url.lower().endswith(".pdf"):
+        return iter_pdf_pages(buf, failed)
+    soup = BeautifulSoup(buf.read(), "html.parser", from_encoding=encoding)
+    return [soup.get_text(separator=" ")]
+
+def _url_meta(body, url: Optional[str] = None) -> Dict[str, Any]:
+    return {
         "source": "url",
-        "url": body.url,
+        "url": url or body.url,
         "industry": body.industry,
         "stage": body.stage,
         "tags": body.tags or [],
-    } for ch, v in zip(chunks, vecs)]
+    }
+
+@router.post("/ingest-urls")
+async def ingest_url_bulk(body: IngestURLs):
+    """Concurrent bulk ingest over one pooled async client; per-URL results in input order."""
+    if not body.urls and not body.sitemap:
+        raise HTTPException(status_code=400, detail="Provide urls or sitemap.")
+    def process(url: str, content: bytes, headers) -> Dict[str, Any]:
+        with io.BytesIO(content) as buf:
+            return _ingest_source(url, buf, headers, hashlib.sha256(content).hexdigest(), _url_meta(body, url))
+    try:
+        results = await ingest_urls(body.urls, process, sitemap=body.sitemap, concurrency=body.concurrency,
+                                    per_host=body.per_host, timeout=body.timeout, max_urls=body.max_urls)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Sitemap fetch failed: {e}")
+    return {"ok": all(r["ok"] for r in results), "urls": len(results),
+            "chunks": sum(r["chunks"] for r in results), "results": results}
+
+@router.post("/sources/refresh")
+async def refresh_sources(body: RefreshSources):
+    """Re-check registered URLs with conditional GETs; only changed pages are re-ingested.
 
-    _append_jsonl(records)
-    _upsert_qdrant(records)
-    return {"ok": True, "chunks": len(records)}
+    A ``304`` costs one round trip and no body; a ``200`` whose content hash matches
+    is not re-chunked. Meant to be run on a schedule (``background: true`` from cron).
+    """
+    params = body.model_dump(exclude={"background"})
+    if body.background:
+        job = JOBS.submit("refresh-sources", params)
+        return {"ok": True, "job_id": job["id"], "status": job["status"]}
+    return await _refresh(params)
+
+async def _refresh(params: Dict[str, Any]) -> Dict[str, Any]:
+    urls = params.get("urls") or SOURCES.urls()
+    def process(url: str, content: bytes, headers) -> Dict[str, Any]:
+        meta = (SOURCES.get(url) or {}).get("meta") or {"source": "url", "url": url, "tags": []}
+        with io.BytesIO(content) as buf:
+            return _ingest_source(url, buf, headers, hashlib.sha256(content).hexdigest(), meta)
+    results = await ingest_urls(urls, process, concurrency=params.get("concurrency", 16), per_host=params.get("per_host", 4),
+                                timeout=params.get("timeout", 20.0), max_urls=len(urls), headers=SOURCES.conditional_headers)
+    changed = [r for r in results if r.get("changed")]
+    return {"ok": all(r["ok"] for r in results), "urls": len(results), "changed": len(changed),
+            "chunks": sum(r["chunks"] for r in changed), "replaced": sum(r.get("replaced", 0) for r in changed),
+            "results": results}
+
+def _refresh_job(params: Dict[str, Any], upload: Optional[str] = None, progress=None) -> Dict[str, Any]:
+    return asyncio.run(_refresh(params))
+
+@router.get("/sources")
+def list_sources(limit: int = 100):
+    recs = [SOURCES.get(u) for u in SOURCES.urls()[:limit]]
+    return {"count": len(SOURCES), "sources": [{**{k: v for k, v in r.items() if k != "chunk_ids"}, "chunks": len(r.get("chunk_ids", []))} for r in recs]}
+
+@router.post("/delete")
+def delete_chunks(body: DeleteBody):
+    """Tombstone chunks by id, url and/or filename; space is reclaimed by compaction."""
+    if not (body.ids or body.url or body.filename):
+        raise HTTPException(status_code=400, detail="Provide ids, url or filename.")
+    ids = list(body.ids)
+    if body.url: ids += INDEX.ids_where(url=body.url)
+    if body.filename: ids += INDEX.ids_where(filename=body.filename)
+    deleted = _delete_chunks(sorted(set(ids)))
+    if body.url: SOURCES.forget(body.url)
+    compacting = STORE.needs_compaction() and _compact_soon()
+    return {"ok": True, "deleted": deleted, "compaction_queued": compacting}
+
+def _compact_soon() -> bool:
+    if JOBS.pending("compact-store"):
+        return False
+    JOBS.submit("compact-store", {})
+    return True
+
+def _compact_job(params: Dict[str, Any], upload: Optional[str] = None, progress=None) -> Dict[str, Any]:
+    out = STORE.compact()
+    INDEX.refresh()  # rebuild on the new layout now rather than on the next query
+    return out
+
+@router.post("/store/compact")
+def compact_store(background: bool = True):
+    if background:
+        job = JOBS.submit("compact-store", {})
+        return {"ok": True, "job_id": job["id"], "status": job["status"]}
+    return _compact_job({})
+
+@router.get("/store/stats")
+def store_stats():
+    out = STORE.stats()
+    return {**out, "needs_compaction": STORE.needs_compaction(), "segments": out["segments"][-50:]}
 
 @router.post("/ingest-file")
 async def ingest_file(
@@ -142,135 +333,182 @@ async def ingest_file(
     industry: Optional[str] = Form(None),
     stage: Optional[str] = Form(None),
     tags: Optional[str] = Form(None),
+    background: bool = Form(False),
 ):
-    raw = await file.read()
-    name = (file.filename or "").lower()
-    try:
-        if name.endswith(".pdf"):
-            with io.BytesIO(raw) as bio:
-                reader = PdfReader(bio)
-                text = "".join((p.extract_text() or "") for p in reader.pages)
-        else:
-            text = raw.decode("utf-8", errors="ignore")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Parse failed: {e}")
-
-    chunks = _chunk(text)
-    if not chunks: raise HTTPException(status_code=400, detail="No text extracted.")
-
-    vecs = _embed(chunks)
-    tag_list = [t.strip() for t in (tags or "").split(",") if t.strip()]
-    records = [{
-        "id": str(uuid.uuid4()),
-        "text": ch,
-        "vector": v,
-        "source": "file",
+    params = {
         "filename": file.filename,
         "industry": industry,
         "stage": stage,
-        "tags": tag_list,
-    } for ch, v in zip(chunks, vecs)]
+        "tags": [t.strip() for t in (tags or "").split(",") if t.strip()],
+    }
+    if background:
+        job_id = JOBS.new_id()
+        await run_in_threadpool(_save_upload, file.file, JOBS.upload_path(job_id))
+        job = JOBS.submit("ingest-file", params, job_id=job_id)
+        return {"ok": True, "job_id": job["id"], "status": job["status"]}
+    # UploadFile is already spooled to disk past a small threshold; read it incrementally
+    return await run_in_threadpool(_ingest_file, params, file.file)
+
+def _failed_pages(failed: List[Tuple[int, str]]) -> Dict[str, Any]:
+    """PDF pages that timed out or failed to parse (ingested as empty)."""
+    return {"failed_pages": [{"page": p, "error": e} for p, e in failed]} if failed else {}
 
-    _append_jsonl(records)
-    _upsert_qdrant(records)
-    return {"ok": True, "chunks": len(records)}
+def _save_upload(src, path: str):
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, READ_BLOCK)
 
-def _local_vector_search(q: str, limit: int, industry: Optional[str], stage: Optional[str]):
-    if not _embedder: return []
-    corpus: List[Dict[str, Any]] = []
+def _ingest_file(params: Dict[str, Any], upload, progress=None) -> Dict[str, Any]:
+    f = open(upload, "rb") if isinstance(upload, str) else upload
     try:
-        with open(JSONL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    j = json.loads(line)
-                except Exception:
-                    continue
-                if industry and j.get("industry") != industry: continue
-                if stage and j.get("stage") != stage: continue
-                if isinstance(j.get("vector"), list):
-                    corpus.append(j)
-    except FileNotFoundError:
-        pass
-    if not corpus: return []
-
-    M = np.array([r["vector"] for r in corpus], dtype="float32")
-    M /= (np.linalg.norm(M, axis=1, keepdims=True) + 1e-8)
-    qv = np.array(_embed([q])[0], dtype="float32")
-    qv /= (np.linalg.norm(qv) + 1e-8)
-    scores = M @ qv
-    idx = np.argsort(-scores)[:limit]
-    out = []
-    for i in idx:
-        r = corpus[int(i)]
-        out.append({
-            "id": r["id"],
-            "score": float(scores[int(i)]),
-            "text": r.get("text"),
-            "source": r.get("source"),
-            "url": r.get("url"),
-            "filename": r.get("filename"),
-            "industry": r.get("industry"),
-            "stage": r.get("stage"),
-            "tags": r.get("tags", []),
-        })
-    return out
+        name = (params.get("filename") or "").lower()
+        failed: List[Tuple[int, str]] = []
+        pieces = iter_pdf_pages(f, failed) if name.endswith(".pdf") else iter_text(f)
+        return {**_ingest(pieces, {"source": "file", **params}, progress), **_failed_pages(failed)}
+    finally:
+        if isinstance(upload, str): f.close()
+
+JOBS.register("ingest-url", _ingest_url)
+JOBS.register("ingest-file", _ingest_file)
+JOBS.register("refresh-sources", _refresh_job)
+JOBS.register("compact-store", _compact_job)
+
+@router.get("/jobs")
+def list_jobs(limit: int = 50):
+    return {"queue": JOBS.stats(), "jobs": JOBS.list(limit)}
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job
+
+def _hit(r: Dict[str, Any], score: float) -> Dict[str, Any]:
+    return {
+        "id": r["id"],
+        "score": float(score),
+        "text": r.get("text"),
+        "source": r.get("source"),
+        "url": r.get("url"),
+        "filename": r.get("filename"),
+        "industry": r.get("industry"),
+        "stage": r.get("stage"),
+        "tags": r.get("tags", []),
+        **({"page": r["page"], "page_end": r.get("page_end", r["page"])} if r.get("page") else {}),
+    }
+
+def _local_vector_search(q: str, limit: int, filters: Dict[str, Any], nprobe: Optional[int] = None):
+    INDEX.refresh()
+    if not EMBEDDER.available or not len(INDEX): return []
+    qv = _embed_queries([q])
+    if not qv: return []  # model failed to load: the caller falls back to BM25
+    return [_hit(r, s) for s, r in INDEX.search(qv[0], limit, nprobe=nprobe, **filters)]
+
+@router.get("/ann/report")
+def ann_report(queries: int = 100, limit: int = 10):
+    """Recall@limit and latency of IVF probing vs exact search on the live corpus."""
+    INDEX.refresh()
+    M = INDEX.matrix
+    if not len(M):
+        raise HTTPException(status_code=400, detail="Local store is empty.")
+    ivf = INDEX.ivf
+    if ivf is None:
+        ivf = IVFIndex()
+        ivf.train(M)
+    return recall_report(M, ivf, sample_queries(M, queries), limit=limit)
+
+def _qdrant_hit(r) -> Dict[str, Any]:
+    return _hit({"id": str(r.id), **(r.payload or {})}, r.score)
+
+def _keyword_search(q: str, limit: int, filters: Dict[str, Any]):
+    return [_hit(r, s) for s, r in INDEX.keyword_search(q, limit, **filters)]
+
+def _fuse(lists: List[List[Dict[str, Any]]], limit: int) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of hit lists; ``score`` becomes the fused RRF score."""
+    by_id = {h["id"]: h for hits in reversed(lists) for h in hits}
+    return [{**by_id[i], "score": s} for i, s in rrf([[h["id"] for h in hits] for hits in lists])[:limit]]
+
+def _finish(body: SearchBody, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if (body.mode or "").lower() == "hybrid":
+        return _fuse([hits, _keyword_search(body.q, body.pool(), body.filters())], body.limit)
+    return hits[:body.limit]
+
+def _vector_answer(body: SearchBody, hits: List[Dict[str, Any]], provider: str) -> Tuple[List[Dict[str, Any]], str]:
+    """Results and provider label for a query served by ``provider``'s vector hits."""
+    return _finish(body, hits), provider + ("+bm25" if (body.mode or "").lower() == "hybrid" else "")
+
+def _keyword_answer(body: SearchBody) -> Tuple[List[Dict[str, Any]], str]:
+    return _keyword_search(body.q, body.limit, body.filters()), "local-bm25"
+
+@router.get("/qdrant/status")
+def qdrant_status():
+    return QDRANT.status()
+
+@router.get("/cache/stats")
+def cache_stats():
+    return QUERY_CACHE.stats()
 
 @router.post("/search")
 def rag_search(body: SearchBody):
-    if (body.provider or "").lower() == "qdrant":
-        client = _client()
-        if client and Filter and FieldCondition and MatchValue:
-            _ensure_collection()
-            try:
-                vec = _embed([body.q])[0]
-                must = []
-                if body.industry: must.append(FieldCondition(key="industry", match=MatchValue(value=body.industry)))
-                if body.stage:    must.append(FieldCondition(key="stage", match=MatchValue(value=body.stage)))
-                flt = Filter(must=must) if must else None
-                res = client.search(collection_name=COLLECTION, query_vector=vec, limit=body.limit, with_payload=True, query_filter=flt)
-                return {"results": [{
-                    "id": str(r.id),
-                    "score": float(r.score),
-                    "text": (r.payload or {}).get("text"),
-                    "source": (r.payload or {}).get("source"),
-                    "url": (r.payload or {}).get("url"),
-                    "filename": (r.payload or {}).get("filename"),
-                    "industry": (r.payload or {}).get("industry"),
-                    "stage": (r.payload or {}).get("stage"),
-                    "tags": (r.payload or {}).get("tags", []),
-                } for r in res], "provider": "qdrant"}
-            except Exception:
-                pass
-
-    local_vec = _local_vector_search(body.q, body.limit, body.industry, body.stage)
+    results, provider = _search_one(body)
+    return {"results": results, "provider": provider}
+
+def _search_one(body: SearchBody) -> Tuple[List[Dict[str, Any]], str]:
+    if (body.mode or "").lower() == "keyword":
+        return _keyword_answer(body)
+    vec = _embed_queries([body.q]) if (body.provider or "").lower() == "qdrant" and QDRANT.available else []
+    if vec:
+        try:
+            res = QDRANT.search(vec[0], body.pool(), match_filter(body.filters()))
+            return _vector_answer(body, [_qdrant_hit(r) for r in res], "qdrant")
+        except Exception:
+            pass  # breaker counts it; fall through to local
+
+    local_vec = _local_vector_search(body.q, body.pool(), body.filters(), body.nprobe)
     if local_vec:
-        return {"results": local_vec, "provider": "local-vectors"}
+        return _vector_answer(body, local_vec, "local-vectors")
 
-    # keyword fallback
-    corpus = []
-    try:
-        with open(JSONL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    j = json.loads(line)
-                except Exception:
-                    continue
-                if body.industry and j.get("industry") != body.industry: continue
-                if body.stage and j.get("stage") != body.stage: continue
-                corpus.append(j)
-    except FileNotFoundError:
-        pass
-    qset = set(_clean(body.q).lower().split())
-    scored = []
-    for r in corpus:
-        words = set(_clean(r.get("text","")).lower().split())
-        inter = len(qset & words)
-        scored.append((inter / max(1, len(qset)), r))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return {"results": [{
-        "id": r["id"], "score": float(s),
-        "text": r.get("text"), "source": r.get("source"),
-        "url": r.get("url"), "filename": r.get("filename"),
-        "industry": r.get("industry"), "stage": r.get("stage"),
-        "tags": r.get("tags", []),
-    } for s, r in scored[:body.limit]], "provider": "local-bow"}
+    # lexical fallback (no embedder, empty vector store, or no vector hits)
+    return _keyword_answer(body)
+
+@router.post("/search-batch")
+def rag_search_batch(body: SearchBatchBody):
+    """N queries, one embedding call, one scoring pass; results come back in query order.
+
+    Each query gets the same results and provider label as ``/search`` would give
+    it: keyword queries skip the vector pass, hybrid ones fuse it with BM25, and
+    queries without vector hits fall back to BM25. Each query goes to its own
+    ``provider`` (the batch's, when set): Qdrant queries are sent as one batch, the
+    rest (and any Qdrant ones that fail) as one local batch. ``providers`` says what
+    served each query; ``provider`` is that if they all agree, else ``"mixed"``.
+    """
+    qs = body.queries
+    if not qs:
+        return {"results": [], "provider": None, "providers": []}
+    out: List[Any] = [None] * len(qs)
+    served: List[str] = ["local-bm25"] * len(qs)
+    vq = [j for j, b in enumerate(qs) if (b.mode or "").lower() != "keyword"]
+    vecs = dict(zip(vq, _embed_queries([qs[j].q for j in vq]))) if vq else {}
+    local = [j for j in vq if j in vecs]
+    remote = [j for j in local if (body.provider or qs[j].provider or "").lower() == "qdrant"]
+    if remote and QDRANT.available:
+        try:
+            res = QDRANT.search_batch([{"vector": vecs[j], "limit": qs[j].pool(), "filter": match_filter(qs[j].filters())} for j in remote])
+            for j, rs in zip(remote, res):
+                out[j], served[j] = _vector_answer(qs[j], [_qdrant_hit(r) for r in rs], "qdrant")
+            local = [j for j in local if out[j] is None]
+        except Exception:
+            pass
+
+    INDEX.refresh()
+    if local and len(INDEX):
+        hits = INDEX.search_batch([vecs[j] for j in local], [qs[j].pool() for j in local], [qs[j].filters() for j in local],
+                                  nprobes=[qs[j].nprobe for j in local])
+        for j, h in zip(local, hits):
+            if h:
+                out[j], served[j] = _vector_answer(qs[j], [_hit(r, s) for s, r in h], "local-vectors")
+
+    for j, b in enumerate(qs):
+        if out[j] is None:
+            out[j], served[j] = _keyword_answer(b)
+    return {"results": out, "provider": served[0] if len(set(served)) == 1 else "mixed", "providers": served}
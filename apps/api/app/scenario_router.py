@@ -0,0 +1,108 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
+from .models.schema import Tree
+from .logic.propagate import DEFAULT_WEIGHT, CompiledTree, compile_tree, tree_key
+from .logic.attribution import cached_attribute, sensitivity
+from .logic.simulate import Spec, simulate
+
+router = APIRouter(prefix="/metric-tree", tags=["metric-tree"])
+
+class PropagateBody(BaseModel):
+    tree: Tree
+    deltas: Optional[Dict[str, float]] = Field(default=None, description="One scenario: node id -> own delta (0.05 = +5%).")
+    scenarios: Optional[List[Dict[str, float]]] = Field(default=None, description="Many scenarios, evaluated together.")
+    default_weight: float = DEFAULT_WEIGHT
+    include_nodes: bool = True
+
+class DeltaRange(BaseModel):
+    low: float
+    high: float
+    dist: Literal["uniform", "normal", "triangular"] = "uniform"  # normal: [low, high] is a 95% interval
+    mode: Optional[float] = None  # triangular peak (default: midpoint)
+
+class SimulateBody(BaseModel):
+    tree: Tree  # edges with ci95 get sampled weights
+    deltas: Dict[str, float] = Field(default_factory=dict, description="Fixed own deltas.")
+    ranges: Dict[str, DeltaRange] = Field(default_factory=dict, description="Sampled own deltas.")
+    draws: int = Field(default=10000, ge=1, le=2_000_000)
+    seed: Optional[int] = None
+    quantiles: List[float] = Field(default_factory=lambda: [0.05, 0.25, 0.5, 0.75, 0.95])
+    include_nodes: bool = True
+    workers: Optional[int] = Field(default=None, ge=1, description="Process-pool shards (default: automatic for large runs).")
+    default_weight: float = DEFAULT_WEIGHT
+
+class AttributionBody(BaseModel):
+    tree: Tree
+    deltas: Dict[str, float] = Field(default_factory=dict)
+    node: Optional[str] = Field(default=None, description="Node to explain (default: the North Star).")
+    k: int = Field(default=5, ge=1, le=1000, description="Top individual paths to return.")
+    limit: int = Field(default=20, ge=1, le=10000, description="Top per-source contributions to return.")
+    default_weight: float = DEFAULT_WEIGHT
+
+class SensitivityBody(BaseModel):
+    tree: Tree
+    deltas: Dict[str, float] = Field(default_factory=dict, description="Current deltas to linearize product/ratio edges around.")
+    node: Optional[str] = Field(default=None, description="Node to differentiate (default: the North Star).")
+    limit: Optional[int] = Field(default=None, ge=1)
+    default_weight: float = DEFAULT_WEIGHT
+
+def _compiled(tree: Tree, default_weight: float = DEFAULT_WEIGHT, key: Optional[str] = None) -> CompiledTree:
+    try:
+        return compile_tree(tree, default_weight, key)
+    except ValueError as e:  # includes CycleError
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/propagate")
+def propagate(body: PropagateBody):
+    """Bottom-up delta propagation to the North Star, honouring each edge's relation.
+
+    ``deltas`` returns scalars (like the web client's ``computePropagation``);
+    ``scenarios`` returns one value per scenario for every node.
+    """
+    if body.deltas is None and not body.scenarios:
+        raise HTTPException(status_code=400, detail="Provide deltas or scenarios.")
+    ct = _compiled(body.tree, body.default_weight)
+    single = body.deltas is not None
+    try:
+        D = ct.deltas([body.deltas] if single else body.scenarios)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    X = ct.propagate(D)
+    if single:
+        X = X[:, 0]
+    out = {"north_star": ct.ids[ct.root], "ns_delta": X[ct.root].tolist()}
+    if body.include_nodes:
+        out["by_id"] = dict(zip(ct.ids, X.tolist()))
+    return out
+
+@router.post("/simulate")
+def simulate_scenarios(body: SimulateBody):
+    """Monte Carlo over input ranges and edge-weight uncertainty: NSM quantiles plus per-node distributions."""
+    if any(not 0 <= q <= 1 for q in body.quantiles):
+        raise HTTPException(status_code=400, detail="quantiles must be within [0, 1].")
+    ct = _compiled(body.tree, body.default_weight)
+    try:
+        spec = Spec(ct, body.tree, body.deltas, {k: r.model_dump() for k, r in body.ranges.items()})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return simulate(ct, spec, body.draws, body.seed, body.quantiles, body.workers, body.include_nodes)
+
+@router.post("/attribution")
+def attribution(body: AttributionBody):
+    """Where a node's delta comes from: per-source totals plus the top-k individual paths."""
+    key = tree_key(body.tree, body.default_weight)
+    ct = _compiled(body.tree, body.default_weight, key)
+    try:
+        return cached_attribute(key, ct, body.deltas, body.node, body.k, body.limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/sensitivity")
+def sensitivities(body: SensitivityBody):
+    """Which lever moves the North Star most per point of change: d(NSM)/d(node) for every node, ranked."""
+    ct = _compiled(body.tree, body.default_weight)
+    try:
+        return sensitivity(ct, body.deltas, body.node, body.limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+from app.logic import store as store_mod
+from app.logic.store import SegmentStore
+from app.logic.index import CorpusIndex
+
+DIM = 16
+
+def _records(ks):
+    rng = np.random.default_rng(0)
+    V = rng.standard_normal((max(ks) + 1, DIM)).astype(np.float32)
+    return V, [{"id": f"r{k}", "hash": f"h{k}", "k": k, "text": f"text {k}", "vector": V[k]} for k in ks]
+
+def _store(tmp_path, monkeypatch, n=40, segment_rows=8):
+    monkeypatch.setattr(store_mod, "FSYNC", False)
+    st = SegmentStore(str(tmp_path / "store"), segment_rows=segment_rows)
+    V, recs = _records(range(n))
+    st.append(recs)
+    return st, V
+
+def _alive_ids(idx):
+    idx._checked = 0.0
+    idx.refresh()
+    return sorted(idx.by_id, key=lambda i: int(i[1:]))
+
+def test_compaction_keeps_tombstones_recorded_during_the_rewrite(tmp_path, monkeypatch):
+    st, _ = _store(tmp_path, monkeypatch)
+    idx = CorpusIndex(st)
+    assert idx.delete(["r1", "r2"]) == 2  # dead before: dropped by the rewrite
+    vectors, late = st.vectors, []
+    def vectors_during_copy(seg):
+        if not late:  # the copy has started: delete rows it is about to move
+            late.append(idx.delete(["r20", "r38"]))
+        return vectors(seg)
+    monkeypatch.setattr(st, "vectors", vectors_during_copy)
+    out = st.compact()
+    monkeypatch.undo()
+    assert out["ok"] and out["dropped"] == 2 and late == [2]
+    alive = _alive_ids(idx)
+    assert "r20" not in alive and "r38" not in alive  # r20 was moved, r38 sits in the live segment
+    assert alive == [f"r{k}" for k in range(40) if k not in (1, 2, 20, 38)]
+    # the re-pointed tombstone must hit r20's new row, not a neighbour
+    fresh = CorpusIndex(st)
+    assert _alive_ids(fresh) == alive
+
+def test_delete_retries_when_a_compaction_moves_the_rows(tmp_path, monkeypatch):
+    st, _ = _store(tmp_path, monkeypatch)
+    idx = CorpusIndex(st)
+    idx.delete(["r0", "r3"])
+    idx.refresh()
+    delete, calls = st.delete, []
+    def delete_after_compaction(rows, epoch=None):
+        calls.append(epoch)
+        if len(calls) == 1:
+            st.compact()  # rows and epoch the index located are now stale
+        return delete(rows, epoch)
+    monkeypatch.setattr(st, "delete", delete_after_compaction)
+    assert idx.delete(["r10", "r25"]) == 2
+    assert len(calls) == 2 and calls[1] == calls[0] + 1
+    monkeypatch.undo()
+    assert _alive_ids(CorpusIndex(st)) == [f"r{k}" for k in range(40) if k not in (0, 3, 10, 25)]
+
+def test_search_during_compaction_reload(tmp_path, monkeypatch):
+    st, V = _store(tmp_path, monkeypatch, n=200, segment_rows=16)
+    idx = CorpusIndex(st)
+    idx.refresh()
+    probe = list(range(0, 200, 7))  # never deleted
+    errors, stop = [], threading.Event()
+    def reader():
+        k = 0
+        while not stop.is_set():
+            j = probe[k % len(probe)]
+            k += 1
+            try:
+                hits = idx.search(V[j], 1)
+                if not hits or hits[0][1].get("k") != j:
+                    errors.append((j, hits[:1]))
+                kw = idx.keyword_search(f"text {j}", 3)
+                if any(r.get("id") != f"r{r.get('k')}" for _, r in kw):
+                    errors.append(("keyword", kw))
+            except Exception as e:  # pragma: no cover - the failure being tested for
+                errors.append(e)
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads: t.start()
+    try:
+        for k in range(1, 200, 7):
+            idx.delete([f"r{k}", f"r{k + 1}"])
+            if k % 3 == 1:
+                st.compact()
+                idx._checked = 0.0
+                idx.refresh()
+    finally:
+        stop.set()
+        for t in threads: t.join()
+    assert not errors, errors[:3]
+    assert len(_alive_ids(idx)) == 200 - 2 * len(range(1, 200, 7))
@@ -0,0 +1,78 @@
+import io, hashlib
+import numpy as np
+from app import rag_router as R
+from app.logic import store as store_mod
+from app.logic.store import SegmentStore
+from app.logic.index import CorpusIndex
+from app.logic.sources import SourceRegistry
+
+URL = "http://example.test/a"
+V1 = "<p>Version one of the page. It has two sentences.</p>"
+V2 = "<p>Version two is different. Totally new text here.</p>"
+
+class _NoQdrant:
+    available = False
+
+class _Embedder:
+    available, model_name = True, "test"
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_mod, "FSYNC", False)
+    st = SegmentStore(str(tmp_path / "store"))
+    monkeypatch.setattr(R, "STORE", st)
+    monkeypatch.setattr(R, "INDEX", CorpusIndex(st))
+    monkeypatch.setattr(R, "SOURCES", SourceRegistry(str(tmp_path / "sources.jsonl")))
+    monkeypatch.setattr(R, "QDRANT", _NoQdrant())
+    monkeypatch.setattr(R, "EMBEDDER", _Embedder())
+    model = {"up": True, "short": 0}
+    def embed(texts):
+        if not model["up"]:
+            return []
+        vs = [np.random.default_rng(len(t)).standard_normal(8).astype("float32") for t in texts]
+        return vs[:len(vs) - model["short"]]
+    monkeypatch.setattr(R, "_embed", embed)
+    return model
+
+def _ingest(html):
+    body = html.encode()
+    return R._ingest_source(URL, io.BytesIO(body), {"content-type": "text/html"},
+                            hashlib.sha256(body).hexdigest(), {"source": "url", "url": URL})
+
+def _live():
+    R.INDEX._checked = 0.0
+    return sorted(R.INDEX.ids_where(url=URL))
+
+def test_reingest_keeps_old_version_until_new_one_is_embedded(tmp_path, monkeypatch):
+    model = _setup(tmp_path, monkeypatch)
+    first = _ingest(V1)
+    assert first["ok"] and first["chunks"] >= 1
+    old = _live()
+
+    model["up"] = False  # model down: nothing of the new version can be stored
+    out = _ingest(V2)
+    assert not out["ok"] and out["unembedded"] >= 1 and out["replaced"] == 0
+    assert _live() == old
+    assert R.SOURCES.get(URL)["hash"] == hashlib.sha256(V1.encode()).hexdigest()
+
+    model["up"], model["short"] = True, 1  # partial batch: one chunk left without a vector
+    long = "<p>" + " ".join(f"Sentence {i} talks about topic {i} at some length." for i in range(400)) + "</p>"
+    out = _ingest(long)
+    assert not out["ok"] and out["unembedded"] >= 1 and out["replaced"] == 0
+    assert set(old) <= set(_live())
+    assert R.SOURCES.get(URL)["hash"] == hashlib.sha256(V1.encode()).hexdigest()
+
+    model["short"] = 0  # retry succeeds: old chunks replaced, new hash recorded
+    out = _ingest(V2)
+    assert out["ok"] and out["unembedded"] == 0 and out["replaced"] == len(old)
+    assert not set(old) & set(_live())
+    assert R.SOURCES.get(URL)["hash"] == hashlib.sha256(V2.encode()).hexdigest()
+
+def test_stored_chunks_need_no_vector(tmp_path, monkeypatch):
+    model = _setup(tmp_path, monkeypatch)
+    assert _ingest(V1)["ok"]
+    stored = _live()
+    model["up"] = False
+    # same chunks, different page bytes: all already stored under their ids
+    out = _ingest(V1 + "<!-- touched -->")
+    assert out["ok"] and out["unembedded"] == 0 and out["duplicates"] == len(stored)
+    assert _live() == stored
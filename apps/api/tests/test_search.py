@@ -0,0 +1,41 @@
+import numpy as np
+from app import rag_router as R
+from app.logic import store as store_mod
+from app.logic.store import SegmentStore
+from app.logic.index import CorpusIndex
+
+TEXTS = ["pricing power in retail", "churn in subscription software", "retail footfall after price cuts"]
+
+class _NoQdrant:
+    available = False
+
+class _Embedder:
+    available, model_name = True, "test"
+
+def _vec(text):
+    return np.random.default_rng(len(text)).standard_normal(8).astype("float32")
+
+def test_batch_answers_like_single_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_mod, "FSYNC", False)
+    st = SegmentStore(str(tmp_path / "store"))
+    st.append([{"id": f"c{k}", "text": t, "industry": "retail" if "retail" in t else "saas", "vector": _vec(t)}
+               for k, t in enumerate(TEXTS)])
+    monkeypatch.setattr(R, "STORE", st)
+    monkeypatch.setattr(R, "INDEX", CorpusIndex(st))
+    monkeypatch.setattr(R, "QDRANT", _NoQdrant())
+    monkeypatch.setattr(R, "EMBEDDER", _Embedder())
+    monkeypatch.setattr(R, "_embed_queries", lambda qs: [_vec(q) for q in qs])
+    queries = [
+        R.SearchBody(q="retail price", limit=2),
+        R.SearchBody(q="retail price", limit=2, mode="hybrid"),
+        R.SearchBody(q="retail price", limit=2, mode="keyword"),
+        R.SearchBody(q="retail price", limit=2, industry="mining"),  # no vector hits
+        R.SearchBody(q="churn", limit=2, provider="qdrant"),  # Qdrant down: served locally
+    ]
+    single = [R.rag_search(b) for b in queries]
+    batch = R.rag_search_batch(R.SearchBatchBody(queries=queries))
+    assert batch["providers"] == [s["provider"] for s in single]
+    assert batch["providers"][:4] == ["local-vectors", "local-vectors+bm25", "local-bm25", "local-bm25"]
+    for got, want in zip(batch["results"], single):
+        assert [h["id"] for h in got] == [h["id"] for h in want["results"]]
+        assert np.allclose([h["score"] for h in got], [h["score"] for h in want["results"]], atol=1e-5)
@@ -45,17 +45,42 @@ export async function lintTree(tree: any) {
 export async function ragSearch(
   q: string,
   provider: 'qdrant' | 'local' = 'local',
-  filters?: { industry?: string; stage?: string },
+  filters?: { industry?: string; stage?: string; mode?: 'keyword' | 'hybrid' },
   limit = 8
 ) {
   return jpost('/rag/search', { q, provider, ...filters, limit });
 }
 
+/** Batched RAG search: one round-trip and one embedding call for many queries.
+ *  `provider`, when given, applies to every query; otherwise each query's own is used. */
+export async function ragSearchBatch(
+  queries: {
+    q: string; limit?: number; industry?: string; stage?: string; tags?: string[];
+    mode?: 'keyword' | 'hybrid'; provider?: 'qdrant' | 'local';
+  }[],
+  provider?: 'qdrant' | 'local'
+) {
+  return jpost('/rag/search-batch', { queries, provider });
+}
+
 /** Ingest a URL (PDF/HTML) into the RAG store */
 export async function ingestUrl(url: string, meta?: { industry?: string; stage?: string; tags?: string[] }) {
   return jpost('/rag/ingest-url', { url, ...(meta || {}) });
 }
 
+/** Bulk-ingest many URLs and/or a sitemap concurrently */
+export async function ingestUrls(
+  urls: string[],
+  meta?: { sitemap?: string; industry?: string; stage?: string; tags?: string[]; concurrency?: number }
+) {
+  return jpost('/rag/ingest-urls', { urls, ...(meta || {}) });
+}
+
+/** Re-check ingested URLs (all registered ones by default); only changed pages are re-ingested */
+export async function refreshSources(opts?: { urls?: string[]; concurrency?: number; background?: boolean }) {
+  return jpost('/rag/sources/refresh', opts || {});
+}
+
 /** Ingest a file into the RAG store */
 export async function ingestFile(file: File, meta?: { industry?: string; stage?: string; tags?: string[] }) {
   const form = new FormData();
@@ -90,5 +115,43 @@ export async function ideateMetrics(payload: {
 }) {
   return jpost('/metric-tree/ideate', payload);
 }
+/** Server-side scenario propagation (relation-aware); pass `scenarios` to evaluate many at once */
+export async function propagateScenarios(
+  tree: any,
+  opts: { deltas?: Record<string, number>; scenarios?: Record<string, number>[]; default_weight?: number; include_nodes?: boolean }
+) {
+  return jpost('/metric-tree/propagate', { tree, ...opts });
+}
+
+export type DeltaRange = { low: number; high: number; dist?: 'uniform' | 'normal' | 'triangular'; mode?: number };
+
+export async function simulateScenarios(
+  tree: any,
+  opts: {
+    deltas?: Record<string, number>;
+    ranges?: Record<string, DeltaRange>;
+    draws?: number;
+    seed?: number;
+    quantiles?: number[];
+    include_nodes?: boolean;
+    default_weight?: number;
+  }
+) {
+  return jpost('/metric-tree/simulate', { tree, ...opts });
+}
+
+export async function attributeContributors(
+  tree: any,
+  opts: { deltas?: Record<string, number>; node?: string; k?: number; limit?: number; default_weight?: number }
+) {
+  return jpost('/metric-tree/attribution', { tree, ...opts });
+}
+
+export async function nodeSensitivities(
+  tree: any,
+  opts: { deltas?: Record<string, number>; node?: string; limit?: number; default_weight?: number } = {}
+) {
+  return jpost('/metric-tree/sensitivity', { tree, ...opts });
+}
 // Back-compat aliases for older imports
 export { ingestUrl as ragIngestUrl, ingestFile as ragIngestFile };
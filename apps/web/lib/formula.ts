@@ -44,7 +44,13 @@ export function numericExpansion(
   return lines;
 }
 
-/** Top path contributors to a node using DFS over children (leaves + self). */
+/**
+ * Top path contributors to a node (leaves + self), largest |weight product × leaf delta| first.
+ * `best[id]` is the largest contribution reachable below `id` (memoized DP, O(edges)), so a
+ * best-first search pops complete paths in order and stops after `limit` of them instead of
+ * enumerating every path. Partial paths are parent links, not copied arrays.
+ * For per-leaf totals and non-linear relations use `attributeContributors` (server side).
+ */
 export function topContributors(
   tree: TreeData,
   nodeId: string,
@@ -60,21 +66,70 @@ export function topContributors(
   const self = deltas[nodeId] ?? 0;
   if (Math.abs(self) > 1e-6) out.push({ path: names[nodeId], contribution: self });
 
-  function dfs(curr: string, accW: number, accPath: string[]) {
-    const kids = chMap[curr] || [];
+  const best: Record<string, number> = {};
+  function bound(id: string): number {
+    if (id in best) return best[id];
+    best[id] = 0; // cycle guard
+    const kids = chMap[id] || [];
+    let b = kids.length ? 0 : Math.abs(deltas[id] ?? 0);
+    for (const e of kids) b = Math.max(b, Math.abs(e.weight ?? defaultWeight) * bound(e.src));
+    return (best[id] = b);
+  }
+
+  type State = { id: string; accW: number; prev: State | null; score: number };
+  const heap: State[] = [];
+  const push = (s: State) => {
+    if (s.score <= 1e-6) return;
+    heap.push(s);
+    for (let i = heap.length - 1; i > 0; ) {
+      const p = (i - 1) >> 1;
+      if (heap[p].score >= heap[i].score) break;
+      [heap[p], heap[i]] = [heap[i], heap[p]];
+      i = p;
+    }
+  };
+  const pop = (): State => {
+    const top = heap[0];
+    const last = heap.pop()!;
+    if (heap.length) {
+      heap[0] = last;
+      for (let i = 0; ; ) {
+        const l = 2 * i + 1, r = l + 1;
+        let m = i;
+        if (l < heap.length && heap[l].score > heap[m].score) m = l;
+        if (r < heap.length && heap[r].score > heap[m].score) m = r;
+        if (m === i) break;
+        [heap[m], heap[i]] = [heap[i], heap[m]];
+        i = m;
+      }
+    }
+    return top;
+  };
+
+  const kids0 = chMap[nodeId] || [];
+  for (const e of kids0) {
+    const w = e.weight ?? defaultWeight;
+    push({ id: e.src, accW: w, prev: null, score: Math.abs(w) * bound(e.src) });
+  }
+  let found = 0;
+  while (heap.length && found < limit) {
+    const s = pop();
+    const kids = chMap[s.id] || [];
     if (!kids.length) {
-      const d = deltas[curr] ?? 0;
-      const c = accW * d;
-      if (Math.abs(c) > 1e-6) out.push({ path: accPath.map(id=>names[id]).join(' → '), contribution: c });
-      return;
+      const ids: string[] = [];
+      for (let p: State | null = s; p; p = p.prev) ids.push(p.id);
+      ids.push(nodeId);
+      out.push({ path: ids.map(id=>names[id]).join(' → '), contribution: s.accW * (deltas[s.id] ?? 0) });
+      found++;
+      continue;
     }
     for (const e of kids) {
       const w = e.weight ?? defaultWeight;
-      dfs(e.src, accW * w, [e.src, ...accPath]);
+      const accW = s.accW * w;
+      push({ id: e.src, accW, prev: s, score: Math.abs(accW) * bound(e.src) });
     }
   }
 
-  dfs(nodeId, 1, [nodeId]);
   out.sort((a,b)=> Math.abs(b.contribution) - Math.abs(a.contribution));
   return out.slice(0, limit);
 }